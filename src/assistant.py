@@ -1,30 +1,23 @@
 import argparse
 import os
-import threading
 from datetime import datetime
 from typing import List
 
 from dotenv import load_dotenv
 from huggingface_hub import login
-from scripts.text_inspector_tool import TextInspectorTool
-from scripts.text_web_browser import (
-    ArchiveSearchTool,
-    FinderTool,
-    FindNextTool,
-    PageDownTool,
-    PageUpTool,
-    SearchInformationTool,
-    SimpleTextBrowser,
-    VisitTool,
-)
-from scripts.visual_qa import visualizer
+from scripts.cache import cache_stats
+from scripts.hierarchy import create_agent_hierarchy
+from scripts.ledger import CostLedger, instrument_model
+from scripts.message_store import MessageStore
+from scripts.model_roles import ROLE_MODEL_HELP, create_role_models, role_model_specs
+from scripts.model_wrappers import LLM_CACHE_MODES, wrap_model_for_cache
+from scripts.self_consistency import run_self_consistency
 from tqdm import tqdm
 
 from smolagents import (
     CodeAgent,
     OpenAIServerModel,
     Model,
-    ToolCallingAgent,
 )
 
 MANAGED_AGENT_PROMPT = """You are a helpful agent named '{name}'.
@@ -47,6 +40,7 @@ And even if your task resolution is not successful, please return as much contex
 """
 
 MODEL="gpt-3.5-turbo-1106"
+API_BASE = os.getenv("LLM_API_BASE", "https://openrouter.ai/api/v1")
 
 AUTHORIZED_IMPORTS = [
     "requests",
@@ -82,74 +76,41 @@ AUTHORIZED_IMPORTS = [
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--question", type=str, required=True)
-    return parser.parse_args()
-
-user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0"
-
-BROWSER_CONFIG = {
-    "viewport_size": 1024 * 5,
-    "downloads_folder": "downloads_folder",
-    "request_kwargs": {
-        "headers": {"User-Agent": user_agent},
-        "timeout": 300,
-    },
-    "serpapi_key": os.getenv("SERPAPI_API_KEY"),
-}
-
-os.makedirs(f"./{BROWSER_CONFIG['downloads_folder']}", exist_ok=True)
-
-def create_agent_hierarchy(model: Model):
-    text_limit = 100000
-    ti_tool = TextInspectorTool(model, text_limit)
-
-    browser = SimpleTextBrowser(**BROWSER_CONFIG)
-
-    WEB_TOOLS = [
-        SearchInformationTool(browser),
-        VisitTool(browser),
-        PageUpTool(browser),
-        PageDownTool(browser),
-        FinderTool(browser),
-        FindNextTool(browser),
-        ArchiveSearchTool(browser),
-        TextInspectorTool(model, text_limit),
-    ]
-    text_webbrowser_agent = ToolCallingAgent(
-        model=model,
-        tools=WEB_TOOLS,
-        max_steps=20,
-        verbosity_level=2,
-        planning_interval=4,
-        name="search_agent",
-        description="""A team member that will search the internet to answer your question.
-    Ask him for all your questions that require browsing the web.
-    Provide him as much context as possible, in particular if you need to search on a specific timeframe!
-    And don't hesitate to provide him with a complex search task, like finding a difference between two webpages.
-    Your request must be a real sentence, not a google search! Like "Find me this information (...)" rather than a few keywords.
-    """,
-        provide_run_summary=True,
+    parser.add_argument(
+        "--llm-cache",
+        choices=LLM_CACHE_MODES,
+        default="passthrough",
+        help="Record model responses to the local cache, or replay them without network.",
     )
-
-    manager_agent = ToolCallingAgent(
-        model=model,
-        tools=[visualizer, ti_tool],
-        max_steps=12,
-        verbosity_level=2,
-        planning_interval=4,
-        managed_agents=[text_webbrowser_agent],
+    parser.add_argument("--ledger-file", type=str, default=None, help="Append per-call costs to this JSONL file.")
+    parser.add_argument(
+        "--samples", type=int, default=1, help="Answer with this many agent hierarchies in parallel and vote."
     )
-    return manager_agent
-
-def answer_single_question(question: str):
-    model = OpenAIServerModel(
-        model_id=MODEL,
-        api_base="https://openrouter.ai/api/v1",
-        api_key=os.environ["SMOL_KEY"],
+    parser.add_argument(
+        "--quorum", type=int, default=None, help="Stop once this many samples agree (default: a majority)."
     )
-    document_inspection_tool = TextInspectorTool(model, 100000)
+    parser.add_argument("--role-model", type=str, action="append", default=[], help=ROLE_MODEL_HELP)
+    return parser.parse_args()
 
-    agent = create_agent_hierarchy(model)
 
+def create_model(llm_cache_mode: str = "passthrough", api_base: str = API_BASE, model_id: str = MODEL) -> Model:
+    model = OpenAIServerModel(
+        model_id=model_id,
+        api_base=api_base,
+        api_key=os.environ.get("SMOL_KEY"),
+    )
+    return wrap_model_for_cache(model, llm_cache_mode)
+
+
+def run_question(
+    agent,
+    model: Model,
+    ledger: CostLedger,
+    message_store: MessageStore,
+    question: str,
+    reformulation_model: Model = None,
+) -> dict:
+    """Answer `question` with an already built agent hierarchy and return the annotated example."""
     augmented_question = (
         """You have one question to answer. It is paramount that you provide a correct answer.
     Give it all you can: I know for a fact that you have access to all the relevant tools to solve it and find the correct answer (the answer does exist). Failure or 'I cannot answer' or 'None found' will not be tolerated, success will be rewarded.
@@ -167,8 +128,15 @@ def answer_single_question(question: str):
 
         # final_result = prepare_response(augmented_question, agent_memory, reformulation_model=model)
         from scripts.reformulator import prepare_response
-        final_result = prepare_response(augmented_question, agent_memory, reformulation_model=model)
-
+        final_result = prepare_response(
+            augmented_question,
+            agent_memory,
+            reformulation_model=instrument_model(reformulation_model or model, ledger, "reformulator"),
+            agent_answer=output,
+        )
+        reformulated_answer = str(final_result)
+
+        message_store.intern_steps(agent.memory.steps)
         intermediate_steps = [str(step) for step in agent.memory.steps]
 
         parsing_error = True if any(["AgentParsingError" in step for step in intermediate_steps]) else False
@@ -178,6 +146,7 @@ def answer_single_question(question: str):
     except Exception as e:
         print("Error on ", augmented_question, e)
         output = None
+        reformulated_answer = None
         intermediate_steps = []
         parsing_error = False
         iteration_limit_exceeded = False
@@ -190,20 +159,70 @@ def answer_single_question(question: str):
         "question": question,
         "augmented_question": augmented_question,
         "prediction": output,
+        "reformulated_answer": reformulated_answer,
         "intermediate_steps": intermediate_steps,
         "parsing_error": parsing_error,
         "iteration_limit_exceeded": iteration_limit_exceeded,
         "agent_error": str(exception) if raised_exception else None,
         "start_time": start_time,
         "end_time": end_time,
+        "ledger": ledger.summary(),
+        "budget": agent.budget.report(),
     }
+    return annotated_example
+
+
+def answer_single_question(
+    question: str,
+    llm_cache_mode: str = "passthrough",
+    ledger_file: str = None,
+    samples: int = 1,
+    quorum: int = None,
+    role_model_cli_specs: List[str] = None,
+):
+    model = create_model(llm_cache_mode)
+    role_models = create_role_models(
+        model, lambda model_id: create_model(llm_cache_mode, model_id=model_id), role_model_specs(role_model_cli_specs)
+    )
+    ledger = CostLedger()
+
+    if samples > 1:
+        # Self-consistency: independent hierarchies share the model client and the fetch/search caches. Each run has
+        # its own ledger, so that its budget only counts its own calls, and all of them are merged into `ledger`.
+        def run_once(cancel_event):
+            run_ledger = CostLedger()
+            message_store = MessageStore(compress=True)
+            agent = create_agent_hierarchy(model, run_ledger, message_store, role_models, cancel_event)
+            try:
+                return run_question(agent, model, run_ledger, message_store, question, role_models["reformulator"])
+            finally:
+                ledger.extend(run_ledger)
+
+        annotated_example = run_self_consistency(
+            run_once, question, samples, quorum or samples // 2 + 1, answer_field="reformulated_answer"
+        )
+        annotated_example["ledger"] = ledger.summary()
+        print(f"Self-consistency: {annotated_example['self_consistency']}")
+    else:
+        message_store = MessageStore(compress=True)
+        agent = create_agent_hierarchy(model, ledger, message_store, role_models)
+        annotated_example = run_question(agent, model, ledger, message_store, question, role_models["reformulator"])
+
+    output = annotated_example["prediction"]
     print(f"Answer: {output}")
+    print(f"Cache stats: {cache_stats()}")
+    print(ledger.summary_table())
+    if ledger_file is not None:
+        ledger.write_jsonl(ledger_file)
+    return annotated_example
 
 
 def main():
     args = parse_args()
     print(f"Starting run with arguments: {args}")
-    answer_single_question(args.question)
+    answer_single_question(
+        args.question, args.llm_cache, args.ledger_file, args.samples, args.quorum, role_model_cli_specs=args.role_model
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,295 @@
+import dataclasses
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, Dict, List, Optional, Union
+
+from rich.text import Text
+
+from smolagents import Tool, ToolCallingAgent
+from smolagents.memory import ActionStep, ToolCall
+from smolagents.models import ChatMessage
+from smolagents.monitoring import LogLevel
+from smolagents.utils import AgentGenerationError
+
+from .budget import BudgetController, BudgetedModel
+from .model_wrappers import reset_cascades
+from .text_web_browser import TabbedBrowser
+
+
+# Tools whose calls do not depend on each other's side effects. Page navigation tools (page_up, find_next, ...) act on
+# the current page, and managed agents keep per-run state, so steps using them are executed sequentially.
+PARALLEL_SAFE_TOOLS = {
+    "web_search",
+    "visit_page",
+    "find_archived_url",
+    "inspect_file_as_text",
+    "visualizer",
+    "recall_observation",
+}
+
+DIGEST_CHARS = 300
+# Browser observations start with these lines, which identify the page better than its first characters
+DIGEST_HEADER = re.compile(r"^(?:Address|Title|Viewport position): .*$", re.MULTILINE)
+
+
+def digest_observation(observation: str, step_number: int, max_chars: int = DIGEST_CHARS) -> str:
+    """Shorten an old observation to its page header and first characters, with a pointer to recall it in full."""
+    if len(observation) <= max_chars:
+        return observation
+    headers = DIGEST_HEADER.findall(observation[:2000])
+    body = observation.split("=======================", 1)[-1].strip() if headers else observation
+    head = "\n".join(headers + [body[:max_chars].rstrip()])
+    return (
+        f"{head}\n[... {len(observation)} characters elided. "
+        f"Use recall_observation with step={step_number} to see this observation again.]"
+    )
+
+
+class RunCancelled(Exception):
+    pass
+
+
+class RecallObservationTool(Tool):
+    name = "recall_observation"
+    description = "Return the full observation of a previous step, when only a shortened version of it is shown in your memory."
+    inputs = {"step": {"type": "integer", "description": "The step number given in the shortened observation."}}
+    output_type = "string"
+
+    def __init__(self):
+        super().__init__()
+        self.agent = None
+
+    def forward(self, step: int) -> str:
+        # Latest first: a resumed run numbers its new steps from 1 again
+        for memory_step in reversed(self.agent.memory.steps):
+            if isinstance(memory_step, ActionStep) and memory_step.step_number == step and memory_step.observations:
+                return memory_step.observations
+        return f"No observation was recorded at step {step}."
+
+
+class _ReplayModel:
+    """Returns an already generated message once, so that the parent `step` can process it without a new model call."""
+
+    def __init__(self, model, message: ChatMessage):
+        self.model = model
+        self.message = message
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs) -> ChatMessage:
+        return self.message
+
+
+class ResearchToolCallingAgent(ToolCallingAgent):
+    """A ToolCallingAgent that executes every tool call of a step, running independent ones concurrently.
+
+    Browser tools must hold a `TabbedBrowser`: each concurrent call then works in its own tab, and the tab of the last
+    browser call (in the model's order) becomes the current page afterwards. Observations keep the original order.
+
+    With `keep_observations=K`, only the observations of the last K action steps are sent to the model in full; older
+    ones are replaced by digests in the prompt, and the agent gets a `recall_observation` tool to read them again.
+    Memory itself keeps every observation, and so do summaries (`summary_mode=True`).
+
+    With a `budget`, each run gets the full budget: past its soft limit the model is told to wrap up, and past its
+    hard limit the run ends after the current step with the agent's final answer.
+
+    With a `cancel_event`, the run raises `RunCancelled` at the end of the step during which the event is set, or as
+    soon as a tool call returns. A cancelled managed agent thus stops its manager too, instead of being reported to it
+    as a failed tool call.
+    """
+
+    def __init__(
+        self,
+        *args,
+        tools: List[Tool],
+        parallel_tool_calls: bool = True,
+        max_tool_workers: int = 4,
+        keep_observations: Optional[int] = None,
+        budget: Optional[BudgetController] = None,
+        cancel_event: Optional[threading.Event] = None,
+        **kwargs,
+    ):
+        recall_tool = RecallObservationTool() if keep_observations is not None else None
+        super().__init__(*args, tools=tools + ([recall_tool] if recall_tool else []), **kwargs)
+        if recall_tool is not None:
+            recall_tool.agent = self
+        self.parallel_tool_calls = parallel_tool_calls
+        self.max_tool_workers = max_tool_workers
+        self.keep_observations = keep_observations
+        self.budget = budget
+        if budget is not None:
+            self.model = BudgetedModel(self.model, budget)
+            self.step_callbacks.append(self._enforce_budget)
+        self.cancel_event = cancel_event
+        if cancel_event is not None:
+            self.step_callbacks.append(self._raise_if_cancelled)
+        self.is_running = False
+        self._resume: Optional[Dict[str, Any]] = None
+        self._resume_steps: Optional[list] = None
+
+    def resume_from(self, task: str, steps: list) -> None:
+        """Continue from `steps` instead of starting over the next time this agent is run on `task`."""
+        self._resume = {"task": task, "steps": steps}
+
+    def run(self, task: str, *args, **kwargs):
+        resume, self._resume = self._resume, None
+        max_steps = self.max_steps
+        if resume is not None and resume["task"] == task:
+            completed = sum(isinstance(memory_step, ActionStep) for memory_step in resume["steps"])
+            self.logger.log(f"Resuming after {completed} completed steps.", level=LogLevel.INFO)
+            self._resume_steps = resume["steps"]
+            self.max_steps = max(max_steps - completed, 1)
+        if self.budget is not None:
+            self.budget.restart()
+        # Each run starts its cascades, and those of its tools (e.g. the text inspector), on the cheapest model
+        for model in [self.model, *(getattr(tool, "model", None) for tool in self.tools.values())]:
+            if model is not None:
+                reset_cascades(model)
+        self.is_running = True
+        try:
+            return super().run(task, *args, **kwargs)
+        finally:
+            self.is_running = False
+            self.max_steps = max_steps
+
+    def _enforce_budget(self, memory_step) -> None:
+        if self.budget.status() == "hard" and self.max_steps > self.step_number:
+            self.logger.log(f"Out of budget ({self.budget.describe_usage()}): wrapping up.", level=LogLevel.INFO)
+            # The run loop stops after this step and asks the model for a final answer
+            self.max_steps = self.step_number
+
+    def _raise_if_cancelled(self, memory_step=None) -> None:
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise RunCancelled("Another run already reached the quorum.")
+
+    def execute_tool_call(self, tool_name: str, arguments: Union[Dict[str, str], str]) -> Any:
+        try:
+            return super().execute_tool_call(tool_name, arguments)
+        finally:
+            # Also replaces the tool error that a cancelled managed agent turns into
+            self._raise_if_cancelled()
+
+    def _run(self, task: str, images=None):
+        if self._resume_steps is not None:
+            # Replaces the memory that `run` just reset, including its task step
+            self.memory.steps, self._resume_steps = self._resume_steps, None
+        yield from super()._run(task, images)
+
+    def write_memory_to_messages(self, summary_mode: Optional[bool] = False) -> List[Dict[str, str]]:
+        # Digests only shorten the agent's own prompt: run summaries and reformulation see the full observations
+        if self.keep_observations is None or summary_mode:
+            return super().write_memory_to_messages(summary_mode=summary_mode)
+        observed = [
+            index
+            for index, memory_step in enumerate(self.memory.steps)
+            if isinstance(memory_step, ActionStep) and memory_step.observations
+        ]
+        stale = set(observed[: max(len(observed) - self.keep_observations, 0)])
+        messages = self.memory.system_prompt.to_messages(summary_mode=summary_mode)
+        for index, memory_step in enumerate(self.memory.steps):
+            if index in stale:
+                memory_step = dataclasses.replace(
+                    memory_step,
+                    observations=digest_observation(memory_step.observations, memory_step.step_number),
+                )
+            messages.extend(memory_step.to_messages(summary_mode=summary_mode))
+        return messages
+
+    def _tools_and_managed_agents(self) -> List[Any]:
+        # Managed agents are called like tools, so the model (and a cascade judging its calls) must be offered both
+        tools_and_managed_agents = getattr(self, "tools_and_managed_agents", None)
+        if tools_and_managed_agents is not None:
+            return list(tools_and_managed_agents)
+        return [*self.tools.values(), *self.managed_agents.values()]
+
+    def step(self, memory_step: ActionStep) -> Union[None, Any]:
+        memory_messages = self.write_memory_to_messages()
+        self.input_messages = memory_messages
+        memory_step.model_input_messages = memory_messages.copy()
+        try:
+            model_message: ChatMessage = self.model(
+                memory_messages,
+                tools_to_call_from=self._tools_and_managed_agents(),
+                stop_sequences=["Observation:"],
+            )
+        except Exception as e:
+            raise AgentGenerationError(f"Error in generating tool call with model:\n{e}", self.logger) from e
+
+        tool_calls = model_message.tool_calls or []
+        final_answer_calls = [tool_call for tool_call in tool_calls if tool_call.function.name == "final_answer"]
+        if final_answer_calls:
+            model_message.tool_calls = final_answer_calls[:1]
+        if len(tool_calls) <= 1 or final_answer_calls:
+            # Nothing to parallelize: let the parent process this message as usual
+            return self._step_with_message(memory_step, model_message)
+
+        memory_step.model_output_message = model_message
+        memory_step.tool_calls = [
+            ToolCall(name=tool_call.function.name, arguments=tool_call.function.arguments, id=tool_call.id)
+            for tool_call in tool_calls
+        ]
+        run_in_parallel = self.parallel_tool_calls and all(
+            tool_call.name in PARALLEL_SAFE_TOOLS for tool_call in memory_step.tool_calls
+        )
+        self.logger.log(
+            Text(
+                f"Calling {len(tool_calls)} tools {'in parallel' if run_in_parallel else 'in sequence'}: "
+                + ", ".join(f"'{tool_call.name}' with arguments: {tool_call.arguments}" for tool_call in memory_step.tool_calls)
+            ),
+            level=LogLevel.INFO,
+        )
+        if run_in_parallel:
+            observations = self._execute_in_tabs(memory_step.tool_calls)
+        else:
+            observations = [self._execute_safely(tool_call) for tool_call in memory_step.tool_calls]
+
+        updated_information = "\n\n".join(
+            f"Observation {i + 1} ({tool_call.name}):\n{observation}"
+            for i, (tool_call, observation) in enumerate(zip(memory_step.tool_calls, observations))
+        )
+        self.logger.log(f"Observations: {updated_information.replace('[', '|')}", level=LogLevel.INFO)
+        memory_step.observations = updated_information
+        return None
+
+    def _step_with_message(self, memory_step: ActionStep, model_message: ChatMessage) -> Union[None, Any]:
+        model = self.model
+        self.model = _ReplayModel(model, model_message)
+        try:
+            return super().step(memory_step)
+        finally:
+            self.model = model
+
+    def _execute_safely(self, tool_call: ToolCall) -> str:
+        try:
+            return str(self.execute_tool_call(tool_call.name, tool_call.arguments or {})).strip()
+        except RunCancelled:
+            raise
+        except Exception as e:
+            return f"Error: {e}"
+
+    def _browsers(self, tool_name: str) -> List[TabbedBrowser]:
+        browser = getattr(self.tools.get(tool_name), "browser", None)
+        return [browser] if isinstance(browser, TabbedBrowser) else []
+
+    def _execute_in_tabs(self, tool_calls: List[ToolCall]) -> List[str]:
+        tabs: List[Optional[list]] = [None] * len(tool_calls)
+
+        def run(index: int) -> str:
+            with ExitStack() as stack:
+                tabs[index] = [
+                    (browser, stack.enter_context(browser.open_tab())) for browser in self._browsers(tool_calls[index].name)
+                ]
+                return self._execute_safely(tool_calls[index])
+
+        with ThreadPoolExecutor(max_workers=self.max_tool_workers) as executor:
+            observations = list(executor.map(run, range(len(tool_calls))))
+
+        # Merge the tabs back in call order, so that the last browser call decides the current page
+        merged = [(index, browser, tab) for index, opened in enumerate(tabs) for browser, tab in opened or []]
+        for position, (index, browser, tab) in enumerate(merged):
+            is_last = all(other_browser is not browser for _, other_browser, _ in merged[position + 1 :])
+            browser.main.merge_tab(tab, take_page=is_last)
+        return observations
@@ -0,0 +1,135 @@
+"""Rule-based normalization of final answers to the GAIA answer format.
+
+`normalize_final_answer` rewrites bare answers the way the reformulation prompt asks for (digits without thousands
+separators or units, no final punctuation, ", "-separated lists). Only numbers, short noun phrases and lists of them
+are handled: anything that reads like a sentence returns None, as does anything else it is not confident about, so
+that callers can fall back to the LLM reformulation.
+"""
+
+import re
+import threading
+from typing import Optional
+
+
+MAX_ANSWER_CHARS = 120
+MAX_ANSWER_WORDS = 12
+MAX_PHRASE_WORDS = 6
+
+# Questions with explicit formatting requirements are left to the LLM
+FORMATTING_HINTS = re.compile(
+    r"\b(round|decimal|significant|alphabeti|order|sort|format|abbreviat|thousands?|millions?|billions?|percent|"
+    r"units?|in (?:usd|dollars|euros|km|kilometers|miles|meters|kg|grams|seconds|minutes|hours|days)|"
+    r"scientific|fraction|iso|yyyy|mm/dd|dd/mm|date|time|initials|capitaliz|upper ?case|lower ?case)\w*",
+    re.IGNORECASE,
+)
+NUMBER_QUESTION = re.compile(r"\b(how (?:many|much|long|far|old)|what (?:is|was) the (?:number|count|total))\b", re.I)
+UNCERTAIN_ANSWER = re.compile(
+    r"\b(unable|cannot|can't|could not|not sure|unknown|unclear|none found|no answer|don't know|i think|probably|"
+    r"approximately|about|around|maybe)\b",
+    re.IGNORECASE,
+)
+NUMBER = re.compile(
+    r"^(?P<currency>[$€£])?\s*(?P<number>-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?)\s*(?P<unit>%|[A-Za-z]{1,12})?$"
+)
+# Units that are always dropped; other suffixes only when the question asks for a quantity
+CURRENCY_UNITS = {"%", "usd", "eur", "gbp", "dollars", "euros", "percent"}
+# Verbs, pronouns and lead-ins that mark a sentence ("The answer is Paris", "It was written by Mark Twain") rather than
+# a bare value; articles are kept, as they can be part of a name ("The Netherlands")
+SENTENCE_WORDS = set(
+    "answer is are was were be been being am has have had do does did will would can could shall should may might must "
+    "i it he she we they you my our their this these those there that which who based according".split()
+)
+WORD = re.compile(r"[A-Za-z]+")
+# Answers that stand for no answer at all, and bare articles, are never final
+PLACEHOLDERS = {"none", "null", "nil", "n/a", "na", "nan", "unknown", "not found", "nothing", "-", "the", "a", "an"}
+# Dotted abbreviations such as "St." or "U.S." cannot be expanded without the LLM
+ABBREVIATION = re.compile(r"\b[A-Za-z]{1,3}\.(?:[A-Za-z]\.?)*(?=\s|$)")
+
+WORD_NUMBERS = {
+    word: str(i)
+    for i, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen sixteen "
+        "seventeen eighteen nineteen twenty".split()
+    )
+}
+
+fast_path_stats = {"attempts": 0, "hits": 0}
+_stats_lock = threading.Lock()
+
+
+def _normalize_number(answer: str, expect_number: bool) -> Optional[str]:
+    if answer.lower() in WORD_NUMBERS:
+        return WORD_NUMBERS[answer.lower()]
+    match = NUMBER.match(answer)
+    if match is None:
+        return None
+    unit = match.group("unit")
+    if unit is not None and unit.lower() not in CURRENCY_UNITS and not expect_number:
+        return None
+    return match.group("number").replace(",", "")
+
+
+def _normalize_string(answer: str) -> Optional[str]:
+    if (
+        len(answer.split()) > MAX_PHRASE_WORDS
+        or ABBREVIATION.search(answer)
+        or re.search(r"[\n:;()\[\]{}]", answer)
+        or any(word.lower() in SENTENCE_WORDS for word in WORD.findall(answer))
+    ):
+        return None
+    return answer
+
+
+def _normalize_element(answer: str, expect_number: bool) -> Optional[str]:
+    answer = answer.strip().strip("\"'`*").rstrip(".!?").strip()
+    if not answer or answer.lower() in PLACEHOLDERS:
+        return None
+    number = _normalize_number(answer, expect_number)
+    if number is not None:
+        return number
+    if expect_number or NUMBER.match(answer):
+        # Whether to keep a unit is up to the question
+        return None
+    return _normalize_string(answer)
+
+
+def normalize_final_answer(answer: Optional[str], question: str = "") -> Optional[str]:
+    """Return `answer` rewritten to the GAIA answer format, or None if it cannot be done with confidence."""
+    if answer is None:
+        return None
+    answer = answer.strip()
+    answer = re.sub(r"^final answer:\s*", "", answer, flags=re.IGNORECASE)
+    if (
+        not answer
+        or "\n" in answer
+        or len(answer) > MAX_ANSWER_CHARS
+        or len(answer.split()) > MAX_ANSWER_WORDS
+        or UNCERTAIN_ANSWER.search(answer)
+        or FORMATTING_HINTS.search(question)
+    ):
+        return None
+
+    expect_number = NUMBER_QUESTION.search(question) is not None
+    # Lists: thousands separators are only allowed inside a single number
+    if ";" in answer or ("," in answer and NUMBER.match(answer) is None):
+        if re.search(r"\d,\d{3}\b", answer):
+            # "1,000, 2,000": can't tell thousands separators from list separators
+            return None
+        elements = [_normalize_element(element, expect_number) for element in re.split(r"[,;]", answer)]
+        if any(element is None for element in elements):
+            return None
+        return ", ".join(elements)
+    return _normalize_element(answer, expect_number)
+
+
+def try_fast_path(answer: Optional[str], question: str = "") -> Optional[str]:
+    """Normalize `answer` and record whether the LLM reformulation could be skipped."""
+    normalized = normalize_final_answer(answer, question)
+    with _stats_lock:
+        fast_path_stats["attempts"] += 1
+        if normalized is not None:
+            fast_path_stats["hits"] += 1
+        hits, attempts = fast_path_stats["hits"], fast_path_stats["attempts"]
+    if normalized is not None:
+        print(f"> Fast path: answer already conforms, skipping reformulation ({hits}/{attempts} answers so far)")
+    return normalized
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from smolagents.models import ChatMessage, MessageRole, Model
+
+from .model_wrappers import ModelWrapper
+
+
+@dataclass
+class Budget:
+    """Limits on one agent run; None means unlimited. Past `soft_fraction` of any limit the agent is told to wrap up."""
+
+    wall_seconds: Optional[float] = None
+    tokens: Optional[int] = None
+    bytes_fetched: Optional[int] = None
+    soft_fraction: float = 0.8
+
+
+QUESTION_BUDGET = Budget(
+    wall_seconds=float(os.getenv("QUESTION_WALL_SECONDS", 30 * 60)),
+    tokens=int(os.getenv("QUESTION_TOKENS", 2_000_000)),
+    bytes_fetched=int(os.getenv("QUESTION_BYTES", 500 * 1024 * 1024)),
+)
+SUB_AGENT_BUDGET = Budget(
+    wall_seconds=float(os.getenv("SUB_AGENT_WALL_SECONDS", 10 * 60)),
+    tokens=int(os.getenv("SUB_AGENT_TOKEN_BUDGET", 100_000)),
+    bytes_fetched=int(os.getenv("SUB_AGENT_BYTES", 100 * 1024 * 1024)),
+)
+
+WRAP_UP_MESSAGE = """Budget notice: you have used {usage}. Stop researching now.
+Use your next action to call final_answer with the best answer you can give from what you have found so far, and say what remains uncertain."""
+
+
+class BudgetController:
+    """Tracks the wall time, tokens and fetched bytes of an agent run against a `Budget`.
+
+    It can be fed like a `CostLedger` (`record_model_call` / `record_tool_call`, e.g. through `instrument_model` and
+    `instrument_tools`) or as a ledger listener with `record`. A sub-agent's controller takes its parent's state into
+    account, so a sub-agent wraps up when the whole question runs out of budget.
+    """
+
+    def __init__(self, budget: Budget, parent: Optional["BudgetController"] = None, name: str = "question"):
+        self.budget = budget
+        self.parent = parent
+        self.name = name
+        self.children: List[BudgetController] = []
+        if parent is not None:
+            parent.children.append(self)
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.soft_limit_runs = 0
+        self.hard_limit_runs = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self.start_time = time.time()
+        self.tokens = 0
+        self.bytes_fetched = 0
+        self.soft_limit_reached = False
+        self.hard_limit_reached = False
+
+    def restart(self) -> None:
+        """Start a new run: each run of an agent gets the full budget."""
+        with self._lock:
+            self._reset()
+            self.runs += 1
+
+    def add(self, tokens: int = 0, bytes_fetched: int = 0) -> None:
+        with self._lock:
+            self.tokens += tokens or 0
+            self.bytes_fetched += bytes_fetched or 0
+
+    def record_model_call(self, role, model_id, input_tokens, output_tokens, seconds, error=None) -> None:
+        self.add(tokens=(input_tokens or 0) + (output_tokens or 0))
+
+    def record_tool_call(self, name, seconds, bytes_fetched, output_chars, error=None) -> None:
+        self.add(bytes_fetched=bytes_fetched)
+
+    def record(self, record: Dict[str, Any]) -> None:
+        """`CostLedger` listener."""
+        self.add(
+            tokens=record.get("input_tokens", 0) + record.get("output_tokens", 0),
+            bytes_fetched=record.get("bytes_fetched", 0),
+        )
+
+    def usage(self) -> Dict[str, float]:
+        return {
+            "wall_seconds": time.time() - self.start_time,
+            "tokens": self.tokens,
+            "bytes_fetched": self.bytes_fetched,
+        }
+
+    def fractions(self) -> Dict[str, float]:
+        """Fraction of each limited resource used so far."""
+        limits = {
+            "wall_seconds": self.budget.wall_seconds,
+            "tokens": self.budget.tokens,
+            "bytes_fetched": self.budget.bytes_fetched,
+        }
+        usage = self.usage()
+        return {resource: usage[resource] / limit for resource, limit in limits.items() if limit}
+
+    def status(self) -> str:
+        """'ok', 'soft' (time to wrap up) or 'hard' (stop), the worst of this run and of the parent's."""
+        fraction = max(self.fractions().values(), default=0.0)
+        status = "hard" if fraction >= 1 else "soft" if fraction >= self.budget.soft_fraction else "ok"
+        if self.parent is not None:
+            status = max(status, self.parent.status(), key=["ok", "soft", "hard"].index)
+        with self._lock:
+            if status != "ok" and not self.soft_limit_reached:
+                self.soft_limit_reached = True
+                self.soft_limit_runs += 1
+            if status == "hard" and not self.hard_limit_reached:
+                self.hard_limit_reached = True
+                self.hard_limit_runs += 1
+        return status
+
+    def describe_usage(self) -> str:
+        return ", ".join(
+            f"{fraction:.0%} of the {resource.replace('_', ' ')} budget" for resource, fraction in self.fractions().items()
+        )
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "limits": asdict(self.budget),
+            "used": self.usage(),
+            "soft_limit_reached": self.soft_limit_reached,
+            "hard_limit_reached": self.hard_limit_reached,
+            "runs": self.runs,
+            "soft_limit_runs": self.soft_limit_runs,
+            "hard_limit_runs": self.hard_limit_runs,
+            "sub_agents": [child.report() for child in self.children],
+        }
+
+
+class BudgetedModel(ModelWrapper):
+    """Appends a wrap-up instruction to the messages once the controller's soft limit is reached."""
+
+    def __init__(self, model: Model, controller: BudgetController):
+        super().__init__(model)
+        self.controller = controller
+
+    def __call__(self, messages: List[Dict], **kwargs) -> ChatMessage:
+        if self.controller.status() != "ok":
+            usage = self.controller.describe_usage()
+            if self.controller.parent is not None and self.controller.parent.status() != "ok":
+                usage = f"{usage}, and the whole question has used {self.controller.parent.describe_usage()}"
+            messages = messages + [
+                {"role": MessageRole.USER, "content": [{"type": "text", "text": WRAP_UP_MESSAGE.format(usage=usage)}]}
+            ]
+        return super().__call__(messages, **kwargs)
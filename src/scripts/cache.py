@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+CACHE_DIR = os.getenv("DEEP_RESEARCH_CACHE_DIR", ".cache")
+# How long a write waits for another process holding the database lock before failing with "database is locked"
+BUSY_TIMEOUT_SECONDS = 30
+# Access times of hits are written in batches of this many, or with the next write, rather than on every read
+ACCESS_FLUSH_BATCH = 100
+
+_MISSING = object()
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Return the sha256 of a local file, or of the path itself for urls and missing files."""
+    if not os.path.isfile(file_path):
+        return hash_bytes(file_path.encode("utf-8"))
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_question(question: Optional[str]) -> str:
+    """Lowercase and collapse whitespace so trivially different phrasings share a cache entry."""
+    if not question:
+        return ""
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+
+def make_key(*parts: Any) -> str:
+    return hash_bytes(json.dumps(parts, sort_keys=True, default=str).encode("utf-8"))
+
+
+class PersistentCache:
+    """A thread-safe key/value cache backed by SQLite, with TTL and LRU eviction.
+
+    Values must be JSON-serializable. Pass `path=None` to keep the cache in memory only. Reads do not write: the access
+    times that drive LRU eviction are buffered and written with the next write or every `ACCESS_FLUSH_BATCH` hits.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 10000, ttl: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._pending_access: Dict[str, float] = {}
+
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path or ":memory:", timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        self._conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_SECONDS * 1000)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._lookup(key, default, record=True)
+
+    def peek(self, key: str, default: Any = None) -> Any:
+        """Like `get`, for a key whose lookup was already counted as a hit or a miss."""
+        return self._lookup(key, default, record=False)
+
+    def _lookup(self, key: str, default: Any, record: bool) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                if record:
+                    self.misses += 1
+                return default
+            self._pending_access[key] = now
+            if len(self._pending_access) >= ACCESS_FLUSH_BATCH:
+                self._flush_access()
+                self._conn.commit()
+            if record:
+                self.hits += 1
+            return json.loads(row[0])
+
+    def _flush_access(self) -> None:
+        if self._pending_access:
+            self._conn.executemany(
+                "UPDATE entries SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._pending_access.items()],
+            )
+            self._pending_access.clear()
+
+    def set(self, key: str, value: Any) -> None:
+        now = time.time()
+        with self._lock:
+            self._pending_access.pop(key, None)
+            self._flush_access()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for `key`, computing it at most once across concurrent callers."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another thread may have filled the entry while we were waiting
+            value = self._lookup(key, _MISSING, record=False)
+            if value is _MISSING:
+                value = compute()
+                self.set(key, value)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return value
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            cursor = self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,))
+            self.evictions += max(cursor.rowcount, 0)
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed ASC LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self.evictions += max(cursor.rowcount, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending_access.clear()
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_caches: Dict[str, PersistentCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, persistent: bool = True, **kwargs) -> PersistentCache:
+    """Return the process-wide cache registered under `name`, creating it on first use.
+
+    Persistent caches are stored as `<CACHE_DIR>/<name>.sqlite`.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            path = os.path.join(CACHE_DIR, f"{name}.sqlite") if persistent else None
+            _caches[name] = PersistentCache(path, **kwargs)
+        return _caches[name]
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    with _caches_lock:
+        return {name: cache.stats() for name, cache in _caches.items()}
@@ -0,0 +1,136 @@
+import dataclasses
+import gzip
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from smolagents.memory import ActionStep
+
+
+CHECKPOINT_VERSION = 1
+
+
+class RestoredError(Exception):
+    """Stands in for an agent error in a checkpoint: agent errors need a logger and cannot be unpickled."""
+
+    def __init__(self, message: str, error_type: str = "AgentError"):
+        super().__init__(message, error_type)
+        self.message = message
+        self.error_type = error_type
+
+    def __str__(self) -> str:
+        return self.message
+
+    def __repr__(self) -> str:
+        return f"{self.error_type}({self.message!r})"
+
+    def dict(self) -> Dict[str, str]:
+        return {"type": self.error_type, "message": self.message}
+
+
+def _snapshot_step(memory_step):
+    """Copy a memory step without what resuming does not need: its model input and raw API response."""
+    if not dataclasses.is_dataclass(memory_step):
+        return memory_step
+    changes = {}
+    if getattr(memory_step, "model_input_messages", None) is not None:
+        changes["model_input_messages"] = None
+    message = getattr(memory_step, "model_output_message", None)
+    if dataclasses.is_dataclass(message) and getattr(message, "raw", None) is not None:
+        changes["model_output_message"] = dataclasses.replace(message, raw=None)
+    error = getattr(memory_step, "error", None)
+    if error is not None and not isinstance(error, RestoredError):
+        changes["error"] = RestoredError(str(error), type(error).__name__)
+    return dataclasses.replace(memory_step, **changes) if changes else memory_step
+
+
+def _snapshot_agent(agent) -> Dict[str, Any]:
+    return {"task": agent.task, "steps": [_snapshot_step(memory_step) for memory_step in agent.memory.steps]}
+
+
+def find_browser(agent):
+    """Return the browser used by the tools of `agent` or of its managed agents."""
+    for candidate in [agent, *getattr(agent, "managed_agents", {}).values()]:
+        for tool in candidate.tools.values():
+            if getattr(tool, "browser", None) is not None:
+                return tool.browser
+    return None
+
+
+class Checkpointer:
+    """Saves an agent hierarchy's progress after every step, so that an interrupted question can be resumed.
+
+    A checkpoint is a gzipped pickle of the manager's memory, the memory of a managed agent caught mid-run, and the
+    browser's navigation state. Tool results need no checkpoint: the text inspector and visualizer answers, and
+    recorded model responses, are already kept in the persistent caches.
+    """
+
+    def __init__(self, path: str, agent, browser=None):
+        self.path = path
+        self.agent = agent
+        self.browser = browser
+        self._lock = threading.Lock()
+
+    def step_callback(self, memory_step) -> None:
+        self.save()
+
+    def attach(self) -> None:
+        """Save after every step of the manager and of its managed agents."""
+        for agent in [self.agent, *getattr(self.agent, "managed_agents", {}).values()]:
+            agent.step_callbacks.append(self.step_callback)
+
+    def save(self) -> None:
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "time": time.time(),
+            "manager": _snapshot_agent(self.agent),
+            "managed_agents": {
+                name: _snapshot_agent(agent)
+                for name, agent in getattr(self.agent, "managed_agents", {}).items()
+                if getattr(agent, "is_running", False)
+            },
+            "browser": self.browser.get_state() if self.browser is not None else None,
+        }
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with gzip.open(temp_path, "wb", compresslevel=6) as fp:
+                pickle.dump(state, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.path)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with gzip.open(self.path, "rb") as fp:
+                state = pickle.load(fp)
+        except Exception as e:
+            print(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+        return state if state.get("version") == CHECKPOINT_VERSION else None
+
+    def restore(self) -> int:
+        """Arm the agents to resume from the saved checkpoint, if any. Return the number of steps restored."""
+        state = self.load()
+        if state is None:
+            return 0
+        self.agent.resume_from(state["manager"]["task"], state["manager"]["steps"])
+        managed_agents = getattr(self.agent, "managed_agents", {})
+        for name, saved in state["managed_agents"].items():
+            if name in managed_agents:
+                # Picked up if the manager asks the same thing again, which is the case when replaying its model calls
+                managed_agents[name].resume_from(saved["task"], saved["steps"])
+        if self.browser is not None and state["browser"] is not None:
+            self.browser.set_state(state["browser"])
+        return sum(
+            isinstance(memory_step, ActionStep)
+            for saved in [state["manager"], *state["managed_agents"].values()]
+            for memory_step in saved["steps"]
+        )
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
@@ -0,0 +1,75 @@
+"""The GAIA evaluation set, downloaded and preprocessed once, then memory-mapped from a local Arrow copy.
+
+Importing this module is cheap: `datasets` and the Hugging Face login are only needed the first time a split is
+loaded on a machine.
+"""
+
+import json
+import os
+from collections import Counter
+from functools import lru_cache
+from typing import Dict
+
+from .cache import CACHE_DIR
+
+
+GAIA_DATASET = "gaia-benchmark/GAIA"
+GAIA_CONFIG = "2023_all"
+GAIA_CACHE_DIR = os.path.join(CACHE_DIR, "gaia")
+
+
+def _split_dir(split: str) -> str:
+    return os.path.join(GAIA_CACHE_DIR, f"{GAIA_CONFIG}_{split}")
+
+
+def _preprocess(split: str):
+    import datasets
+    from huggingface_hub import login
+
+    login(os.getenv("HF_TOKEN"))
+    eval_ds = datasets.load_dataset(GAIA_DATASET, GAIA_CONFIG)[split]
+    eval_ds = eval_ds.rename_columns({"Question": "question", "Final answer": "true_answer", "Level": "task"})
+
+    def preprocess_file_paths(row):
+        if len(row["file_name"]) > 0:
+            row["file_name"] = f"data/gaia/{split}/" + row["file_name"]
+        return row
+
+    return eval_ds.map(preprocess_file_paths)
+
+
+def build_attachments_index(eval_ds) -> Dict[str, Dict]:
+    """Map the task id of every question with an attached file to the file's path and size, if present locally."""
+    index = {}
+    for task_id, file_name in zip(eval_ds["task_id"], eval_ds["file_name"]):
+        if file_name:
+            index[str(task_id)] = {
+                "file_name": file_name,
+                "size": os.path.getsize(file_name) if os.path.isfile(file_name) else None,
+            }
+    return index
+
+
+@lru_cache(maxsize=None)
+def load_eval_set(split: str = "validation"):
+    """Return the preprocessed `split`, building its local copy on first use."""
+    import datasets
+
+    split_dir = _split_dir(split)
+    if not os.path.isdir(split_dir):
+        eval_ds = _preprocess(split)
+        temp_dir = f"{split_dir}.tmp"
+        eval_ds.save_to_disk(temp_dir)
+        with open(os.path.join(temp_dir, "attachments.json"), "w", encoding="utf-8") as fp:
+            json.dump(build_attachments_index(eval_ds), fp)
+        os.replace(temp_dir, split_dir)
+    # Memory-mapped: only the rows that are read get paged in
+    eval_ds = datasets.load_from_disk(split_dir)
+    print(f"Loaded evaluation dataset: {dict(sorted(Counter(eval_ds['task']).items()))} questions per level")
+    return eval_ds
+
+
+def load_attachments_index(split: str = "validation") -> Dict[str, Dict]:
+    load_eval_set(split)
+    with open(os.path.join(_split_dir(split), "attachments.json"), encoding="utf-8") as fp:
+        return json.load(fp)
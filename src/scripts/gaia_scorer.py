@@ -1,6 +1,18 @@
+import argparse
 import re
 import string
 import warnings
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Compiled once: normalize_str and split_string are called for every scored answer
+WHITESPACE = re.compile(r"\s")
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+LIST_SEPARATORS = re.compile(r"[,;]")
+NUMBER_NOISE = re.compile(r"[$%,]")
 
 
 def normalize_number_str(number_str: str) -> float:
@@ -19,6 +31,8 @@ def split_string(
     s: str,
     char_list: list[str] = [",", ";"],
 ) -> list[str]:
+    if char_list == [",", ";"]:
+        return LIST_SEPARATORS.split(s)
     pattern = f"[{''.join(char_list)}]"
     return re.split(pattern, s)
 
@@ -77,9 +91,8 @@ def check_prediction_contains_answer_letters_in_order(prediction, true_answer):
         return False
     i = 0
     for letter in true_answer:
-        if letter in prediction[i:]:
-            i += prediction[i:].index(letter)
-        else:
+        i = prediction.find(letter, i)
+        if i == -1:
             return False
     return True
 
@@ -114,11 +127,192 @@ def normalize_str(input_str, remove_punct=True) -> str:
     - str, the normalized string
     """
     # Remove all white spaces. Required e.g for seagull vs. sea gull
-    no_spaces = re.sub(r"\s", "", input_str)
+    no_spaces = WHITESPACE.sub("", input_str)
 
     # Remove punctuation, if specified.
     if remove_punct:
-        translator = str.maketrans("", "", string.punctuation)
-        return no_spaces.lower().translate(translator)
+        return no_spaces.lower().translate(PUNCTUATION_TABLE)
     else:
         return no_spaces.lower()
+
+
+# Batch scoring: the same rules as question_scorer and check_close_call, applied column-wise and without per-answer
+# prints or warnings. Conversions are computed once per distinct value, so repeated answers cost nothing.
+
+
+def _map_unique(values: pd.Series, func: Callable) -> pd.Series:
+    uniques = pd.unique(values)
+    return values.map(dict(zip(uniques, map(func, uniques))))
+
+
+def _to_float(number_str: str) -> float:
+    try:
+        return float(number_str)
+    except ValueError:
+        return float("inf")
+
+
+def normalize_number_strs(values: pd.Series) -> np.ndarray:
+    """Vectorized `normalize_number_str`."""
+    return _map_unique(values.str.replace(NUMBER_NOISE, "", regex=True), _to_float).to_numpy(dtype=float)
+
+
+def normalize_strs(values: pd.Series, remove_punct: bool = True) -> pd.Series:
+    """Vectorized `normalize_str`."""
+    normalized = values.str.replace(WHITESPACE, "", regex=True).str.lower()
+    return normalized.str.translate(PUNCTUATION_TABLE) if remove_punct else normalized
+
+
+def _numbers_match(predictions: pd.Series, truths: pd.Series) -> np.ndarray:
+    return normalize_number_strs(predictions) == _map_unique(truths, float).to_numpy(dtype=float)
+
+
+def _lists_match(predictions: pd.Series, truths: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """Element-wise list comparison; also returns which rows failed on a length mismatch."""
+    gt_elems = truths.str.split(LIST_SEPARATORS)
+    ma_elems = predictions.str.split(LIST_SEPARATORS)
+    same_length = (gt_elems.str.len() == ma_elems.str.len()).to_numpy()
+    matches = np.zeros(len(truths), dtype=bool)
+    if same_length.any():
+        # One row per element, labelled with the position of its list
+        gt_flat = gt_elems[same_length].explode().reset_index(drop=True)
+        ma_flat = ma_elems[same_length].explode().reset_index(drop=True)
+        rows = np.repeat(np.flatnonzero(same_length), gt_elems[same_length].str.len().to_numpy())
+        elem_is_number = _map_unique(gt_flat, is_float).to_numpy(dtype=bool)
+        elem_matches = np.empty(len(gt_flat), dtype=bool)
+        elem_matches[elem_is_number] = _numbers_match(ma_flat[elem_is_number], gt_flat[elem_is_number])
+        elem_matches[~elem_is_number] = (
+            normalize_strs(ma_flat[~elem_is_number], remove_punct=False)
+            == normalize_strs(gt_flat[~elem_is_number], remove_punct=False)
+        ).to_numpy()
+        matches[same_length] = pd.Series(elem_matches).groupby(rows).all().to_numpy()
+    return matches, ~same_length
+
+
+def score_answers(predictions: pd.Series, truths: pd.Series) -> pd.DataFrame:
+    """Score many answers at once, exactly like `question_scorer` and `check_close_call` on `str()` of each value.
+
+    Returns, aligned with `predictions`: the answer type ('number', 'list' or 'string', from the ground truth),
+    `is_correct`, `is_close_call` and `list_length_mismatch`.
+    """
+    index = predictions.index
+    predictions = predictions.reset_index(drop=True).map(str)
+    truths = truths.reset_index(drop=True).map(str)
+
+    is_number = _map_unique(truths, is_float).to_numpy(dtype=bool)
+    is_list = ~is_number & truths.str.contains(LIST_SEPARATORS).to_numpy(dtype=bool)
+    is_string = ~is_number & ~is_list
+
+    is_correct = np.zeros(len(truths), dtype=bool)
+    length_mismatch = np.zeros(len(truths), dtype=bool)
+    is_correct[is_number] = _numbers_match(predictions[is_number], truths[is_number])
+    is_correct[is_list], length_mismatch[is_list] = _lists_match(predictions[is_list], truths[is_list])
+    is_correct[is_string] = (normalize_strs(predictions[is_string]) == normalize_strs(truths[is_string])).to_numpy()
+
+    # Close calls only need checking on wrong answers to non-numeric questions
+    is_close_call = is_correct.copy()
+    candidates = ~is_correct & ~is_number
+    is_close_call[candidates] = [
+        check_prediction_contains_answer_letters_in_order(prediction, truth)
+        and len(truth) * 0.5 <= len(prediction) <= len(truth) * 2
+        for prediction, truth in zip(predictions[candidates], truths[candidates])
+    ]
+
+    return pd.DataFrame(
+        {
+            "answer_type": np.select([is_number, is_list], ["number", "list"], "string"),
+            "is_correct": is_correct,
+            "is_close_call": is_close_call,
+            "list_length_mismatch": length_mismatch,
+        },
+        index=index,
+    )
+
+
+def _outcomes(results: pd.DataFrame) -> pd.Series:
+    missing = results["prediction"].isna() | (results["prediction"].astype(str).str.strip() == "")
+    return pd.Series(
+        np.select(
+            [results["is_correct"], missing, results["is_close_call"], results["list_length_mismatch"]],
+            ["correct", "missing", "close call", "list length mismatch"],
+            "wrong",
+        ),
+        index=results.index,
+    )
+
+
+def score_results(
+    results: pd.DataFrame, prediction_col: str = "prediction", truth_col: str = "true_answer"
+) -> pd.DataFrame:
+    """Add the `score_answers` columns and an `outcome` to a results frame, e.g. a loaded answers file."""
+    results = results.rename(columns={prediction_col: "prediction", truth_col: "true_answer"})
+    # Missing answers are read as NaN; score them as the scalar scorer does, as str(None)
+    results["prediction"] = results["prediction"].astype(object).where(results["prediction"].notna(), None)
+    results = results.join(score_answers(results["prediction"], results["true_answer"]))
+    results["outcome"] = _outcomes(results)
+    return results
+
+
+def summarize_scores(scored: pd.DataFrame, level_col: str = "task") -> dict[str, pd.DataFrame]:
+    """Per-level accuracy and close-call rate, and outcome breakdowns per level and per answer type."""
+    levels = scored[level_col] if level_col in scored else pd.Series("all", index=scored.index)
+    close_not_correct = scored["is_close_call"] & ~scored["is_correct"]
+    by_level = pd.DataFrame({"level": levels, "correct": scored["is_correct"], "close_call": close_not_correct})
+    accuracy = by_level.groupby("level").agg(
+        questions=("correct", "size"), accuracy=("correct", "mean"), close_call_rate=("close_call", "mean")
+    )
+    accuracy.loc["all"] = [len(scored), scored["is_correct"].mean(), close_not_correct.mean()]
+    accuracy["questions"] = accuracy["questions"].astype(int)
+    return {
+        "accuracy": accuracy,
+        "outcomes_by_level": pd.crosstab(levels.rename("level"), scored["outcome"], margins=True),
+        "outcomes_by_answer_type": pd.crosstab(scored["answer_type"], scored["outcome"], margins=True),
+    }
+
+
+def load_results(path: str) -> pd.DataFrame:
+    """Load an answers file: JSONL (as written by the batch runs), CSV or Parquet."""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    if path.endswith(".csv"):
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    return pd.read_json(path, lines=True, dtype=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Score a GAIA answers file against the ground truth.")
+    parser.add_argument("results", type=str, help="Answers file (.jsonl, .csv or .parquet).")
+    parser.add_argument(
+        "--truth",
+        type=str,
+        default=None,
+        help="Ground truth file with task_id and true_answer (and task) columns, joined on task_id. "
+        "Defaults to the true_answer column of the answers file.",
+    )
+    parser.add_argument("--prediction-col", type=str, default="prediction")
+    parser.add_argument("--output", type=str, default=None, help="Write the scored answers to this file.")
+    return parser.parse_args()
+
+
+def main(args: Optional[argparse.Namespace] = None) -> None:
+    args = args or parse_args()
+    results = load_results(args.results)
+    if args.truth:
+        truth = load_results(args.truth)
+        truth = truth[[col for col in ["task_id", "true_answer", "task"] if col in truth]]
+        results = results.drop(columns=[col for col in truth if col != "task_id"], errors="ignore")
+        results = results.merge(truth, on="task_id", how="left")
+    scored = score_results(results, prediction_col=args.prediction_col)
+    for name, table in summarize_scores(scored).items():
+        print(f"\n{name.replace('_', ' ').capitalize()}:\n{table.to_string()}")
+    if args.output:
+        columns = [col for col in ["task_id", "task", "prediction", "true_answer"] if col in scored]
+        columns += ["answer_type", "is_correct", "is_close_call", "outcome"]
+        if args.output.endswith(".csv"):
+            scored[columns].to_csv(args.output, index=False)
+        else:
+            scored[columns].to_json(args.output, orient="records", lines=True, force_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""The agent hierarchy shared by the entry points: a manager, its search agent and a pool of search agents for
+parallel sub-questions, all recording into one ledger and one question budget."""
+
+import os
+import threading
+from typing import Optional
+
+from smolagents import Model
+
+from .agents import ResearchToolCallingAgent
+from .budget import QUESTION_BUDGET, SUB_AGENT_BUDGET, BudgetController
+from .ledger import CostLedger, instrument_model, instrument_tools
+from .message_store import MessageStore
+from .search_pool import ParallelSearchTool, SearchAgentPool
+from .text_inspector_tool import TextInspectorTool
+from .text_web_browser import (
+    ArchiveSearchTool,
+    FinderTool,
+    FindNextTool,
+    PageDownTool,
+    PageUpTool,
+    SearchInformationTool,
+    SimpleTextBrowser,
+    TabbedBrowser,
+    VisitTool,
+)
+from .visual_qa import visualizer
+
+
+user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0"
+
+BROWSER_CONFIG = {
+    "viewport_size": 1024 * 5,
+    "downloads_folder": "downloads_folder",
+    "request_kwargs": {
+        "headers": {"User-Agent": user_agent},
+        "timeout": 300,
+    },
+    "serpapi_key": os.getenv("SERPAPI_API_KEY"),
+}
+
+os.makedirs(f"./{BROWSER_CONFIG['downloads_folder']}", exist_ok=True)
+
+
+def create_search_agent(
+    model: Model,
+    ledger: CostLedger = None,
+    step_callbacks: list = None,
+    parent_budget: BudgetController = None,
+    text_inspector_model: Model = None,
+    cancel_event: threading.Event = None,
+    managed_agent_prompt: Optional[str] = None,
+):
+    text_limit = 100000
+    budget = BudgetController(SUB_AGENT_BUDGET, parent=parent_budget, name="search_agent")
+    browser = TabbedBrowser(SimpleTextBrowser(**BROWSER_CONFIG))
+
+    WEB_TOOLS = [
+        SearchInformationTool(browser),
+        VisitTool(browser),
+        PageUpTool(browser),
+        PageDownTool(browser),
+        FinderTool(browser),
+        FindNextTool(browser),
+        ArchiveSearchTool(browser),
+        TextInspectorTool(
+            instrument_model(
+                instrument_model(text_inspector_model or model, ledger, "text_inspector"), budget, "text_inspector"
+            ),
+            text_limit,
+        ),
+    ]
+    text_webbrowser_agent = ResearchToolCallingAgent(
+        model=instrument_model(instrument_model(model, ledger, "search_agent"), budget, "search_agent"),
+        tools=instrument_tools(instrument_tools(WEB_TOOLS, ledger), budget),
+        max_steps=20,
+        verbosity_level=2,
+        planning_interval=4,
+        keep_observations=3,
+        budget=budget,
+        cancel_event=cancel_event,
+        step_callbacks=list(step_callbacks or []),
+        name="search_agent",
+        description="""A team member that will search the internet to answer your question.
+    Ask him for all your questions that require browsing the web.
+    Provide him as much context as possible, in particular if you need to search on a specific timeframe!
+    And don't hesitate to provide him with a complex search task, like finding a difference between two webpages.
+    Your request must be a real sentence, not a google search! Like "Find me this information (...)" rather than a few keywords.
+    """,
+        provide_run_summary=True,
+        # Without a prompt of its own, the agent keeps the smolagents default
+        **({"managed_agent_prompt": managed_agent_prompt} if managed_agent_prompt is not None else {}),
+    )
+    return text_webbrowser_agent
+
+
+def create_agent_hierarchy(
+    model: Model,
+    ledger: CostLedger = None,
+    message_store: MessageStore = None,
+    role_models: dict = None,
+    cancel_event: threading.Event = None,
+    search_agent_prompt: Optional[str] = None,
+):
+    """Build the manager and its search agents. `role_models` (see `create_role_models`) overrides `model` per role.
+
+    Once `cancel_event` is set, every agent of the hierarchy stops at its next step or tool call with `RunCancelled`.
+    """
+    role_models = role_models or {}
+    search_model = role_models.get("search_agent", model)
+    text_inspector_model = role_models.get("text_inspector", model)
+    text_limit = 100000
+    ti_tool = TextInspectorTool(instrument_model(text_inspector_model, ledger, "text_inspector"), text_limit)
+    step_callbacks = [message_store.step_callback] if message_store is not None else []
+    budget = BudgetController(QUESTION_BUDGET)
+    if ledger is not None:
+        ledger.add_listener(budget.record)
+
+    def search_agent_factory():
+        return create_search_agent(
+            search_model, ledger, step_callbacks, budget, text_inspector_model, cancel_event, search_agent_prompt
+        )
+
+    text_webbrowser_agent = search_agent_factory()
+    search_pool = SearchAgentPool(search_agent_factory)
+
+    manager_agent = ResearchToolCallingAgent(
+        model=instrument_model(role_models.get("manager", model), ledger, "manager"),
+        tools=instrument_tools([visualizer, ti_tool, ParallelSearchTool(search_pool)], ledger),
+        max_steps=12,
+        verbosity_level=2,
+        planning_interval=4,
+        managed_agents=[text_webbrowser_agent],
+        budget=budget,
+        cancel_event=cancel_event,
+        step_callbacks=list(step_callbacks),
+    )
+    return manager_agent
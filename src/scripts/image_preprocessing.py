@@ -0,0 +1,101 @@
+import base64
+import math
+import os
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from .cache import get_cache, hash_bytes, make_key
+
+
+# Vision endpoints downscale large images anyway, so sending more than this only adds upload time
+DEFAULT_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", 1536 * 1536))
+DEFAULT_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 1024 * 1024))
+
+JPEG_QUALITY = 85
+MIN_JPEG_QUALITY = 60
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+@dataclass
+class EncodedImage:
+    mime_type: str
+    base64_data: str
+    width: int
+    height: int
+
+    @property
+    def data_uri(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64_data}"
+
+    @property
+    def num_bytes(self) -> int:
+        return len(self.base64_data) * 3 // 4
+
+
+def _fit_to_pixels(image: Image.Image, max_pixels: int) -> Image.Image:
+    width, height = image.size
+    if width * height <= max_pixels:
+        return image
+    scale = math.sqrt(max_pixels / (width * height))
+    return image.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+
+
+def _encode(image: Image.Image, max_bytes: int) -> tuple[str, bytes]:
+    """Re-encode `image`, shrinking quality then size until it fits in `max_bytes`."""
+    # Keep transparency and flat-colour images (diagrams, screenshots) lossless, photos go to JPEG
+    lossless = image.mode in ("RGBA", "LA", "PA", "P", "1") or "transparency" in image.info
+    while True:
+        buffer = BytesIO()
+        if lossless:
+            image.save(buffer, format="PNG", optimize=True)
+            if buffer.tell() <= max_bytes:
+                return "image/png", buffer.getvalue()
+        else:
+            rgb_image = image.convert("RGB")
+            for quality in range(JPEG_QUALITY, MIN_JPEG_QUALITY - 1, -10):
+                buffer = BytesIO()
+                rgb_image.save(buffer, format="JPEG", quality=quality, optimize=True)
+                if buffer.tell() <= max_bytes:
+                    return "image/jpeg", buffer.getvalue()
+        width, height = image.size
+        if width <= 64 or height <= 64:
+            return ("image/png" if lossless else "image/jpeg"), buffer.getvalue()
+        image = image.resize((int(width * 0.75), int(height * 0.75)), Image.LANCZOS)
+
+
+def prepare_image(
+    image_path: str, max_pixels: int = DEFAULT_MAX_PIXELS, max_bytes: int = DEFAULT_MAX_BYTES
+) -> EncodedImage:
+    """Decode a local image once, downsize it to the pixel/byte budget and return it base64-encoded.
+
+    Images that already fit the budget in a format the endpoints accept are sent untouched. Encoded payloads are
+    cached in memory by content hash and budget.
+    """
+    with open(image_path, "rb") as fh:
+        data = fh.read()
+
+    cache = get_cache("image_payloads", persistent=False, max_entries=64)
+    key = make_key(hash_bytes(data), max_pixels, max_bytes)
+    cached = cache.get(key)
+    if cached is not None:
+        return EncodedImage(**cached)
+
+    image = Image.open(BytesIO(data))
+    width, height = image.size
+    if (
+        image.format in PASSTHROUGH_FORMATS
+        and width * height <= max_pixels
+        and len(data) <= max_bytes
+        and not getattr(image, "is_animated", False)
+    ):
+        mime_type, payload = PASSTHROUGH_FORMATS[image.format], data
+    else:
+        image = _fit_to_pixels(ImageOps.exif_transpose(image), max_pixels)
+        mime_type, payload = _encode(image, max_bytes)
+        width, height = image.size
+
+    encoded = EncodedImage(mime_type, base64.b64encode(payload).decode("utf-8"), width, height)
+    cache.set(key, encoded.__dict__)
+    return encoded
@@ -0,0 +1,259 @@
+import copy
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from smolagents import Tool
+from smolagents.models import ChatMessage, Model
+
+from .model_wrappers import CascadeModel, ModelWrapper
+
+
+_write_lock = threading.Lock()
+
+class CostLedger:
+    """Records the tokens and wall time of every model call and the cost of every tool call for one question."""
+
+    def __init__(self, question_id: Optional[str] = None):
+        self.question_id = question_id
+        self.records: List[Dict[str, Any]] = []
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def reset(self, question_id: Optional[str] = None) -> None:
+        """Start recording a new question, for ledgers kept across questions by a long-lived agent hierarchy."""
+        with self._lock:
+            self.question_id = question_id
+            self.records = []
+            self.start_time = time.time()
+
+    def extend(self, other: "CostLedger") -> None:
+        """Add the records of `other`, e.g. of one of several runs on the same question, without notifying listeners."""
+        with other._lock:
+            records = list(other.records)
+        with self._lock:
+            self.records.extend(records)
+
+    def add_listener(self, listener) -> None:
+        """Register a callable that receives every record as it is added."""
+        self._listeners.append(listener)
+
+    def _add(self, record: Dict[str, Any]) -> None:
+        record = {"question_id": self.question_id, "timestamp": time.time(), **record}
+        with self._lock:
+            self.records.append(record)
+        for listener in self._listeners:
+            listener(record)
+
+    def record_model_call(
+        self,
+        role: str,
+        model_id: str,
+        input_tokens: int,
+        output_tokens: int,
+        seconds: float,
+        error: Optional[str] = None,
+    ) -> None:
+        self._add(
+            {
+                "kind": "model",
+                "name": role,
+                "model_id": model_id,
+                "input_tokens": input_tokens or 0,
+                "output_tokens": output_tokens or 0,
+                "seconds": seconds,
+                "error": error,
+            }
+        )
+
+    def record_escalation(self, role: str, from_model_id: str, to_model_id: str, reason: str) -> None:
+        """A cascade handed a `role` call from one model to the next."""
+        self._add(
+            {
+                "kind": "escalation",
+                "name": role,
+                "model_id": from_model_id,
+                "to_model_id": to_model_id,
+                "reason": reason,
+                "seconds": 0.0,
+                "error": None,
+            }
+        )
+
+    def record_tool_call(
+        self, name: str, seconds: float, bytes_fetched: int, output_chars: int, error: Optional[str] = None
+    ) -> None:
+        self._add(
+            {
+                "kind": "tool",
+                "name": name,
+                "seconds": seconds,
+                "bytes_fetched": bytes_fetched,
+                "output_chars": output_chars,
+                "error": error,
+            }
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            records = list(self.records)
+        by_name = defaultdict(lambda: defaultdict(float))
+        for record in records:
+            totals = by_name[f"{record['kind']}:{record['name']}"]
+            totals["calls"] += 1
+            totals["errors"] += record["error"] is not None
+            for field in ("seconds", "input_tokens", "output_tokens", "bytes_fetched", "output_chars"):
+                totals[field] += record.get(field, 0)
+        by_model = defaultdict(lambda: defaultdict(float))
+        for record in records:
+            if record["kind"] == "model":
+                totals = by_model[f"{record['name']}:{record['model_id']}"]
+                totals["calls"] += 1
+                totals["errors"] += record["error"] is not None
+                for field in ("seconds", "input_tokens", "output_tokens"):
+                    totals[field] += record[field]
+        models = [record for record in records if record["kind"] == "model"]
+        tools = [record for record in records if record["kind"] == "tool"]
+        return {
+            "wall_time": time.time() - self.start_time,
+            "model_calls": len(models),
+            "input_tokens": sum(record["input_tokens"] for record in models),
+            "output_tokens": sum(record["output_tokens"] for record in models),
+            "model_seconds": sum(record["seconds"] for record in models),
+            "tool_calls": len(tools),
+            "tool_seconds": sum(record["seconds"] for record in tools),
+            "bytes_fetched": sum(record["bytes_fetched"] for record in tools),
+            "breakdown": {name: dict(totals) for name, totals in sorted(by_name.items())},
+            # Per role and model id, which shows what each model of a cascade costs
+            "models": {name: dict(totals) for name, totals in sorted(by_model.items())},
+        }
+
+    def summary_table(self) -> str:
+        summary = self.summary()
+        lines = [
+            f"{'call':<32} {'calls':>6} {'errors':>6} {'seconds':>9} {'in tokens':>10} {'out tokens':>10} {'bytes':>11} {'out chars':>10}"
+        ]
+        for name, totals in summary["breakdown"].items():
+            lines.append(
+                f"{name:<32} {int(totals['calls']):>6} {int(totals['errors']):>6} {totals['seconds']:>9.1f} "
+                f"{int(totals['input_tokens']):>10} {int(totals['output_tokens']):>10} "
+                f"{int(totals['bytes_fetched']):>11} {int(totals['output_chars']):>10}"
+            )
+        roles = [name.split(":")[0] for name in summary["models"]]
+        if len(roles) > len(set(roles)):
+            for name, totals in summary["models"].items():
+                lines.append(
+                    f"{name:<32} {int(totals['calls']):>6} {int(totals['errors']):>6} {totals['seconds']:>9.1f} "
+                    f"{int(totals['input_tokens']):>10} {int(totals['output_tokens']):>10}"
+                )
+        lines.append(
+            f"Total: {summary['wall_time']:.1f}s wall time, {summary['model_calls']} model calls "
+            f"({summary['input_tokens']} in / {summary['output_tokens']} out tokens, {summary['model_seconds']:.1f}s), "
+            f"{summary['tool_calls']} tool calls ({summary['tool_seconds']:.1f}s, {summary['bytes_fetched']} bytes fetched)"
+        )
+        return "\n".join(lines)
+
+    def write_jsonl(self, jsonl_file: str) -> None:
+        """Append every record, then the summary, to `jsonl_file`."""
+        jsonl_file = Path(jsonl_file)
+        jsonl_file.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            records = list(self.records)
+        with _write_lock, open(jsonl_file, "a", encoding="utf-8") as fp:
+            for record in records:
+                fp.write(json.dumps(record) + "\n")
+            fp.write(json.dumps({"question_id": self.question_id, "kind": "summary", **self.summary()}) + "\n")
+
+
+def _token_counts(message: ChatMessage, model: Model):
+    # Prefer the usage attached to this response: the model's last_*_token_count are shared between threads
+    usage = getattr(getattr(message, "raw", None), "usage", None)
+    if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+        return usage.prompt_tokens, usage.completion_tokens
+    return model.last_input_token_count, model.last_output_token_count
+
+
+class InstrumentedModel(ModelWrapper):
+    """Records every call to the wrapped model in a `CostLedger` under the given role."""
+
+    def __init__(self, model: Model, ledger: CostLedger, role: str):
+        super().__init__(model)
+        self.ledger = ledger
+        self.role = role
+
+    def __call__(self, messages: List[Dict], **kwargs) -> ChatMessage:
+        start = time.time()
+        try:
+            message = super().__call__(messages, **kwargs)
+        except Exception as e:
+            self.ledger.record_model_call(self.role, self.model_id, 0, 0, time.time() - start, error=str(e))
+            raise
+        input_tokens, output_tokens = _token_counts(message, self.model)
+        self.ledger.record_model_call(self.role, self.model_id, input_tokens, output_tokens, time.time() - start)
+        return message
+
+
+def _local_file_size(kwargs: Dict[str, Any]) -> int:
+    for argument in ("file_path", "image_path"):
+        path = kwargs.get(argument)
+        if isinstance(path, str) and os.path.isfile(path):
+            return os.path.getsize(path)
+    return 0
+
+
+def instrument_tool(tool: Tool, ledger: CostLedger) -> Tool:
+    """Return a shallow copy of `tool` whose calls are recorded in `ledger`.
+
+    Bytes fetched are read from the browser's counter for web tools, and from the size of the inspected file for
+    file tools. The original tool is left untouched, so shared tools like `visualizer` can be instrumented per question.
+    """
+    instrumented = copy.copy(tool)
+    forward = tool.forward
+    if getattr(forward, "__self__", None) is tool:
+        # Rebind to the copy, so that attributes swapped on the copy (e.g. its browser) are the ones used
+        forward = forward.__func__.__get__(instrumented)
+
+    def instrumented_forward(*args, **kwargs):
+        browser = getattr(instrumented, "browser", None)
+        bytes_before = browser.bytes_fetched if browser is not None else 0
+        start = time.time()
+        error, output = None, None
+        try:
+            output = forward(*args, **kwargs)
+            return output
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            bytes_fetched = browser.bytes_fetched - bytes_before if browser is not None else _local_file_size(kwargs)
+            ledger.record_tool_call(
+                tool.name, time.time() - start, bytes_fetched, len(str(output)) if output is not None else 0, error
+            )
+
+    instrumented.forward = instrumented_forward
+    return instrumented
+
+
+def instrument_tools(tools: List[Tool], ledger: Optional[CostLedger]) -> List[Tool]:
+    if ledger is None:
+        return tools
+    return [instrument_tool(tool, ledger) for tool in tools]
+
+
+def instrument_model(model: Model, ledger: Optional[CostLedger], role: str) -> Model:
+    if isinstance(model, CascadeModel):
+        # Each model of the cascade is recorded under its own id; the copy also gets its own failure streak
+        cascade = model.with_models([instrument_model(tier, ledger, role) for tier in model.models])
+        if hasattr(ledger, "record_escalation"):
+            cascade.escalation_listeners.append(
+                lambda from_model_id, to_model_id, reason: ledger.record_escalation(role, from_model_id, to_model_id, reason)
+            )
+        return cascade
+    if ledger is None:
+        return model
+    return InstrumentedModel(model, ledger, role)
@@ -1,7 +1,6 @@
 # This is copied from Magentic-one's great repo: https://github.com/microsoft/autogen/blob/v0.4.4/python/packages/autogen-magentic-one/src/autogen_magentic_one/markdown_browser/mdconvert.py
 # Thanks to Microsoft researchers for open-sourcing this!
 # type: ignore
-import base64
 import copy
 import html
 import json
@@ -32,6 +31,8 @@ from bs4 import BeautifulSoup
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.formatters import SRTFormatter
 
+from .image_preprocessing import prepare_image
+
 
 class _CustomMarkdownify(markdownify.MarkdownConverter):
     """
@@ -678,13 +679,7 @@ class ImageConverter(MediaConverter):
 
         sys.stderr.write(f"MLM Prompt:\n{prompt}\n")
 
-        data_uri = ""
-        with open(local_path, "rb") as image_file:
-            content_type, encoding = mimetypes.guess_type("_dummy" + extension)
-            if content_type is None:
-                content_type = "image/jpeg"
-            image_base64 = base64.b64encode(image_file.read()).decode("utf-8")
-            data_uri = f"data:{content_type};base64,{image_base64}"
+        data_uri = prepare_image(local_path).data_uri
 
         messages = [
             {
@@ -0,0 +1,104 @@
+import json
+import threading
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List
+
+from .cache import hash_bytes
+from .model_wrappers import _canonical
+
+
+class MessageRefs(list):
+    """The keys of a list of messages held in a `MessageStore`, in order."""
+
+    def __repr__(self) -> str:
+        return f"MessageRefs({len(self)} messages)"
+
+
+class MessageStore:
+    """Content-addressed store of chat messages, so that a message repeated across steps is kept once.
+
+    Each step's model input repeats the whole conversation so far: interning replaces these copies with references.
+    With `compress=True`, messages longer than `min_compress_chars` are kept as zlib-compressed JSON, which loses
+    non-JSON content such as images (they are replaced by their hash).
+    """
+
+    def __init__(self, compress: bool = False, min_compress_chars: int = 1024):
+        self.compress = compress
+        self.min_compress_chars = min_compress_chars
+        self._messages: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.puts = 0
+
+    def put(self, message: Dict) -> str:
+        encoded = json.dumps(message, sort_keys=True, default=_canonical)
+        key = hash_bytes(encoded.encode("utf-8"))
+        with self._lock:
+            self.puts += 1
+            if key not in self._messages:
+                if self.compress and len(encoded) >= self.min_compress_chars:
+                    self._messages[key] = zlib.compress(encoded.encode("utf-8"))
+                else:
+                    self._messages[key] = message
+        return key
+
+    def get(self, key: str) -> Dict:
+        stored = self._messages[key]
+        if isinstance(stored, bytes):
+            return json.loads(zlib.decompress(stored))
+        return stored
+
+    def intern(self, messages: List[Dict]) -> MessageRefs:
+        if isinstance(messages, MessageRefs):
+            return messages
+        return MessageRefs(self.put(message) for message in messages)
+
+    def resolve(self, refs: Iterable[str]) -> List[Dict]:
+        return [self.get(key) for key in refs]
+
+    def intern_steps(self, steps: Iterable[Any]) -> None:
+        """Replace the `model_input_messages` of every step with references into the store."""
+        for step in steps:
+            if getattr(step, "model_input_messages", None) is not None:
+                step.model_input_messages = self.intern(step.model_input_messages)
+
+    def step_callback(self, memory_step) -> None:
+        """To be passed in an agent's `step_callbacks`, so that steps never hold their own copy of the conversation."""
+        self.intern_steps([memory_step])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._messages.clear()
+            self.puts = 0
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "messages": len(self._messages),
+            "references": self.puts,
+            "compressed": sum(isinstance(stored, bytes) for stored in self._messages.values()),
+        }
+
+    def iter_records(self, steps: Iterable[Any], question_id: str = None) -> Iterator[Dict]:
+        """Yield each message the first time it is referenced, then each step with its message references.
+
+        Steps are serialized one at a time, so that writing a run never builds it in memory as a whole.
+        """
+        written = set()
+        for step in steps:
+            refs = getattr(step, "model_input_messages", None)
+            if refs is not None and not isinstance(refs, MessageRefs):
+                refs = self.intern(refs)
+            for key in refs or []:
+                if key not in written:
+                    written.add(key)
+                    yield {"question_id": question_id, "type": "message", "key": key, "message": self.get(key)}
+            record = step.dict()
+            if refs is not None:
+                record["model_input_messages"] = list(refs)
+            yield {"question_id": question_id, "type": type(step).__name__, **record}
+
+    def write_jsonl(self, fp, steps: Iterable[Any], question_id: str = None) -> None:
+        for record in self.iter_records(steps, question_id):
+            fp.write(json.dumps(record, default=_canonical) + "\n")
@@ -0,0 +1,58 @@
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+from smolagents.models import Model
+
+from .model_wrappers import CascadeModel
+
+
+MODEL_ROLES = ["manager", "search_agent", "text_inspector", "reformulator"]
+ROLE_MODEL_HELP = (
+    "ROLE=MODEL_ID, or ROLE=FAST_ID>STRONG_ID for a cascade that escalates to the stronger model on parse errors, "
+    f"answers that give up or repeated failures. Roles: {', '.join(MODEL_ROLES)}. Also read from <ROLE>_MODEL "
+    "environment variables, e.g. SEARCH_AGENT_MODEL."
+)
+
+
+def parse_role_models(specs: Iterable[str]) -> Dict[str, List[str]]:
+    """Parse 'search_agent=gpt-4o-mini>gpt-4o' style specs into model ids per role, cheapest first."""
+    role_models = {}
+    for spec in specs:
+        role, sep, model_ids = spec.partition("=")
+        role = role.strip()
+        if not sep or role not in MODEL_ROLES:
+            raise ValueError(f"Invalid model spec '{spec}', expected ROLE=MODEL_ID with ROLE one of {MODEL_ROLES}.")
+        role_models[role] = [model_id.strip() for model_id in model_ids.split(">") if model_id.strip()]
+    return role_models
+
+
+def role_model_specs(cli_specs: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+    """Model ids per role from <ROLE>_MODEL environment variables, overridden by command line specs."""
+    env_specs = [f"{role}={os.environ[f'{role.upper()}_MODEL']}" for role in MODEL_ROLES if os.getenv(f"{role.upper()}_MODEL")]
+    return {**parse_role_models(env_specs), **parse_role_models(cli_specs or [])}
+
+
+def create_role_models(
+    default: Model, build_model: Callable[[str], Model], specs: Optional[Dict[str, List[str]]] = None
+) -> Dict[str, Model]:
+    """The model of every role: `default` unless `specs` names others, built once per model id by `build_model`."""
+    built = {}
+
+    def get(model_id: str) -> Model:
+        if model_id not in built:
+            built[model_id] = build_model(model_id)
+        return built[model_id]
+
+    role_models = {}
+    for role in MODEL_ROLES:
+        model_ids = (specs or {}).get(role)
+        if not model_ids:
+            role_models[role] = default
+        elif len(model_ids) == 1:
+            role_models[role] = get(model_ids[0])
+        else:
+            # Only the reformulator's text is a final answer, worth escalating when it gives up
+            role_models[role] = CascadeModel(
+                [get(model_id) for model_id in model_ids], name=role, judge_text=role == "reformulator"
+            )
+    return role_models
@@ -0,0 +1,241 @@
+import json
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from smolagents.models import ChatMessage, Model
+
+from .cache import get_cache, hash_bytes
+
+
+LLM_CACHE_MODES = ["passthrough", "record", "replay"]
+
+
+class ModelWrapper(Model):
+    """Base class for models that add behaviour around another model and delegate everything else to it."""
+
+    def __init__(self, model: Model):
+        self.model = model
+        self.model_id = getattr(model, "model_id", None)
+        self.last_input_token_count = None
+        self.last_output_token_count = None
+
+    def __getattr__(self, name: str) -> Any:
+        # Only reached for attributes the wrapper does not define itself
+        if name == "model":
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def __call__(self, messages: List[Dict], **kwargs) -> ChatMessage:
+        message = self.model(messages, **kwargs)
+        self.last_input_token_count = self.model.last_input_token_count
+        self.last_output_token_count = self.model.last_output_token_count
+        return message
+
+
+class LLMCacheMiss(Exception):
+    pass
+
+
+def _canonical(obj: Any) -> Any:
+    if isinstance(obj, Enum):
+        return obj.value
+    if hasattr(obj, "tobytes"):
+        # Images and arrays are keyed by their content
+        return hash_bytes(obj.tobytes())
+    if hasattr(obj, "name") and hasattr(obj, "inputs"):
+        # Tools are keyed by the schema the model sees
+        return {
+            "name": obj.name,
+            "description": obj.description,
+            "inputs": obj.inputs,
+            "output_type": obj.output_type,
+        }
+    return str(obj)
+
+
+def message_to_dict(message: ChatMessage) -> Dict:
+    tool_calls = None
+    if message.tool_calls:
+        tool_calls = [
+            {
+                "id": tool_call.id,
+                "type": tool_call.type,
+                "function": {"name": tool_call.function.name, "arguments": tool_call.function.arguments},
+            }
+            for tool_call in message.tool_calls
+        ]
+    return {"role": _canonical(message.role), "content": message.content, "tool_calls": tool_calls}
+
+
+class CachingModel(ModelWrapper):
+    """Records model responses keyed by the canonicalized request, and replays them without network.
+
+    Modes:
+        - "record": answer from the store when possible, otherwise call the model and store the response.
+        - "replay": answer from the store only, raising `LLMCacheMiss` for unknown requests.
+        - "passthrough": always call the model, without reading or writing the store.
+    """
+
+    def __init__(self, model: Model, mode: str = "record", store=None):
+        super().__init__(model)
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {LLM_CACHE_MODES}.")
+        self.mode = mode
+        self.store = store if store is not None else get_cache("llm_responses", max_entries=1_000_000)
+
+    def request_key(self, messages: List[Dict], **kwargs) -> str:
+        request = json.dumps([self.model_id, messages, kwargs], sort_keys=True, default=_canonical)
+        return hash_bytes(request.encode("utf-8"))
+
+    def __call__(self, messages: List[Dict], **kwargs) -> ChatMessage:
+        if self.mode == "passthrough":
+            return super().__call__(messages, **kwargs)
+
+        key = self.request_key(messages, **kwargs)
+        cached: Optional[Dict] = self.store.get(key)
+        if cached is not None:
+            self.last_input_token_count = cached["input_tokens"]
+            self.last_output_token_count = cached["output_tokens"]
+            return ChatMessage.from_dict(cached["message"])
+        if self.mode == "replay":
+            raise LLMCacheMiss(f"No recorded response for this request to {self.model_id} (key {key}).")
+
+        message = super().__call__(messages, **kwargs)
+        self.store.set(
+            key,
+            {
+                "message": message_to_dict(message),
+                "input_tokens": self.last_input_token_count,
+                "output_tokens": self.last_output_token_count,
+            },
+        )
+        return message
+
+
+def wrap_model_for_cache(model: Model, mode: str = "passthrough") -> Model:
+    return model if mode == "passthrough" else CachingModel(model, mode=mode)
+
+
+# Answers in which a model gives up, worth a second opinion from a stronger one
+UNSURE_MARKERS = [
+    "i cannot",
+    "i can't",
+    "i could not",
+    "i couldn't",
+    "unable to",
+    "not sure",
+    "i don't know",
+    "cannot be determined",
+    "no information",
+]
+
+
+def _tool_call_arguments(tool_call) -> Any:
+    arguments = tool_call.function.arguments
+    return json.loads(arguments) if isinstance(arguments, str) else arguments
+
+
+def escalation_reason(message: ChatMessage, tools_to_call_from=None, judge_text: bool = False) -> Optional[str]:
+    """Why a response should be retried with a stronger model, or None if it is usable.
+
+    `tools_to_call_from` are the tools offered to the model, managed agents included: a call to any other name is a
+    parse error. With tools, only a `final_answer` call is judged on its content. A text completion is only judged on
+    its content with `judge_text`, for roles whose text is the answer (the reformulator), not for document reading or
+    planning.
+    """
+    if tools_to_call_from:
+        if not message.tool_calls:
+            return "parse_error"
+        tool_names = {tool.name for tool in tools_to_call_from}
+        try:
+            calls = [(tool_call.function.name, _tool_call_arguments(tool_call)) for tool_call in message.tool_calls]
+        except (TypeError, ValueError):
+            return "parse_error"
+        if any(name not in tool_names for name, _ in calls):
+            return "parse_error"
+        # Only a final answer is judged on its content: intermediate actions are checked by their results
+        text = " ".join(str(arguments) for name, arguments in calls if name == "final_answer")
+    else:
+        if not message.content:
+            return "parse_error"
+        if not judge_text:
+            return None
+        text = message.content if isinstance(message.content, str) else json.dumps(message.content)
+    text = text.lower()
+    if any(marker in text for marker in UNSURE_MARKERS):
+        return "low_confidence"
+    return None
+
+
+class CascadeModel(ModelWrapper):
+    """Tries the models in order, cheapest first, and escalates to the next one when a response is unusable.
+
+    A response escalates on a model error, a parse error (no valid tool call when tools are offered, or an empty
+    completion) or low confidence (a final answer that gives up, or with `judge_text` any text completion that does).
+    After `max_failures` escalations in a row, calls go straight to the strongest model until `reset` starts a new run
+    (see `reset_cascades`). Each agent should get its own cascade, e.g. through `with_models` or `instrument_model`,
+    as the failure streak is per run.
+    """
+
+    def __init__(
+        self, models: List[Model], max_failures: int = 2, name: Optional[str] = None, judge_text: bool = False
+    ):
+        if not models:
+            raise ValueError("A cascade needs at least one model.")
+        super().__init__(models[-1])
+        self.models = models
+        self.max_failures = max_failures
+        self.name = name
+        self.judge_text = judge_text
+        self.model_id = " > ".join(str(getattr(model, "model_id", None)) for model in models)
+        self.escalation_listeners = []
+        self._failures = 0
+
+    def with_models(self, models: List[Model]) -> "CascadeModel":
+        """A cascade with the same settings and listeners over other models, with a fresh failure streak."""
+        cascade = CascadeModel(models, max_failures=self.max_failures, name=self.name, judge_text=self.judge_text)
+        cascade.escalation_listeners = list(self.escalation_listeners)
+        return cascade
+
+    def reset(self) -> None:
+        """Start a new run on the cheapest model."""
+        self._failures = 0
+
+    def _escalated(self, from_model: Model, to_model: Model, reason: str) -> None:
+        for listener in self.escalation_listeners:
+            listener(getattr(from_model, "model_id", None), getattr(to_model, "model_id", None), reason)
+
+    def __call__(self, messages: List[Dict], **kwargs) -> ChatMessage:
+        first = len(self.models) - 1 if self._failures >= self.max_failures else 0
+
+        for i in range(first, len(self.models)):
+            model = self.models[i]
+            if i == len(self.models) - 1:
+                message = model(messages, **kwargs)
+                reason = None
+            else:
+                try:
+                    message = model(messages, **kwargs)
+                    reason = escalation_reason(message, kwargs.get("tools_to_call_from"), self.judge_text)
+                except Exception:
+                    reason = "model_error"
+                if reason is not None:
+                    self._escalated(model, self.models[i + 1], reason)
+                    continue
+            if i == 0:
+                self._failures = 0
+            elif first == 0:
+                self._failures += 1
+            self.last_input_token_count = model.last_input_token_count
+            self.last_output_token_count = model.last_output_token_count
+            return message
+
+
+def reset_cascades(model: Model) -> None:
+    """`reset` every cascade that `model` is or wraps."""
+    if isinstance(model, CascadeModel):
+        model.reset()
+        for tier in model.models:
+            reset_cascades(tier)
+    elif isinstance(model, ModelWrapper):
+        reset_cascades(model.model)
@@ -1,11 +1,111 @@
 # Shamelessly stolen from Microsoft Autogen team: thanks to them for this great resource!
 # https://github.com/microsoft/autogen/blob/gaia_multiagent_v01_march_1st/autogen/browser_utils.py
-import copy
+import os
+from typing import Dict, List, Optional
 
 from smolagents.models import MessageRole, Model
 
+from .answer_normalizer import try_fast_path
+
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+REFORMULATION_TOKEN_BUDGET = int(os.getenv("REFORMULATION_TOKEN_BUDGET", 12000))
+
+PLAN_PREFIXES = ("[FACTS LIST]", "[PLAN]", "[FACTS]")
+
+
+def count_tokens(text: str) -> int:
+    if tiktoken is None:
+        # Rough estimate for English text when tiktoken is not installed
+        return len(text) // 4 + 1
+    return len(tiktoken.get_encoding("cl100k_base").encode(text, disallowed_special=()))
+
+
+def _message_text(message: Dict) -> str:
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+
+def _elide(text: str, head: int = 600, tail: int = 300) -> str:
+    if len(text) <= head + tail:
+        return text
+    return f"{text[:head]}\n[... {len(text) - head - tail} characters elided ...]\n{text[-tail:]}"
+
+
+def compact_transcript(inner_messages, token_budget: int = REFORMULATION_TOKEN_BUDGET, keep_last: int = 6) -> List[Dict]:
+    """Turn the agent memory into user messages that fit in `token_budget` tokens.
+
+    The task, the facts/plans and the last `keep_last` messages are kept verbatim. Older tool outputs are elided to
+    their beginning and end first, then the oldest remaining messages are dropped until the transcript fits.
+    """
+    messages = [message for message in inner_messages if message.get("content")]
+    texts = [_message_text(message) for message in messages]
+    protected = [
+        i == 0 or i >= len(messages) - keep_last or text.lstrip().startswith(PLAN_PREFIXES)
+        for i, text in enumerate(texts)
+    ]
+    # Shallow copies: the content lists are shared with the agent memory, never mutated
+    compacted = [{"role": MessageRole.USER, "content": message["content"]} for message in messages]
+    tokens = [count_tokens(text) for text in texts]
+    total = sum(tokens)
+
+    for i, message in enumerate(messages):
+        if total <= token_budget:
+            break
+        if protected[i] or message["role"] != MessageRole.TOOL_RESPONSE:
+            continue
+        elided = _elide(texts[i])
+        if elided != texts[i]:
+            compacted[i] = {"role": MessageRole.USER, "content": [{"type": "text", "text": elided}]}
+            total -= tokens[i] - count_tokens(elided)
+            tokens[i] = count_tokens(elided)
+
+    dropped = set()
+    for i in range(len(messages)):
+        if total <= token_budget:
+            break
+        if not protected[i]:
+            dropped.add(i)
+            total -= tokens[i]
+
+    if not dropped:
+        return compacted
+    print(f"> Compacted transcript: dropped {len(dropped)} of {len(messages)} messages to fit {token_budget} tokens")
+    result = []
+    for i, message in enumerate(compacted):
+        if i in dropped:
+            if i - 1 not in dropped:
+                result.append(
+                    {
+                        "role": MessageRole.USER,
+                        "content": [{"type": "text", "text": "[Earlier steps omitted to fit the context budget]"}],
+                    }
+                )
+            continue
+        result.append(message)
+    return result
+
+
+def prepare_response(
+    original_task: str,
+    inner_messages,
+    reformulation_model: Model,
+    token_budget: int = REFORMULATION_TOKEN_BUDGET,
+    agent_answer: Optional[str] = None,
+) -> str:
+    # Skip the LLM call when the agent's own answer can be normalized with confidence
+    if agent_answer is not None:
+        final_answer = try_fast_path(agent_answer, original_task)
+        if final_answer is not None:
+            print("> Reformulated answer: ", final_answer)
+            return final_answer
 
-def prepare_response(original_task: str, inner_messages, reformulation_model: Model) -> str:
     messages = [
         {
             "role": MessageRole.SYSTEM,
@@ -26,14 +126,9 @@ Your team then worked diligently to address that request. Read below a transcrip
     # if len(inner_messages) > 1:
     #    del inner_messages[0]
 
-    # copy them to this context
+    # copy them to this context, compacted to the token budget
     try:
-        for message in inner_messages:
-            if not message.get("content"):
-                continue
-            message = copy.deepcopy(message)
-            message["role"] = MessageRole.USER
-            messages.append(message)
+        messages += compact_transcript(inner_messages, token_budget=token_budget)
     except Exception:
         messages += [{"role": MessageRole.ASSISTANT, "content": str(inner_messages)}]
 
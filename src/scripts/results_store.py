@@ -0,0 +1,130 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+
+# How long a statement waits for another process holding the database lock
+BUSY_TIMEOUT_SECONDS = 30
+
+
+def answer_seconds(entry: Dict[str, Any]) -> Optional[float]:
+    """Wall time spent answering, from the start and end times of an answer entry."""
+    try:
+        start = datetime.strptime(entry["start_time"], "%Y-%m-%d %H:%M:%S")
+        end = datetime.strptime(entry["end_time"], "%Y-%m-%d %H:%M:%S")
+        return (end - start).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return (entry.get("ledger") or {}).get("wall_time")
+
+
+class ResultsStore:
+    """Answers of evaluation runs in a SQLite database, keyed by (run_id, task_id).
+
+    Each thread gets its own connection, and writers wait for each other on the database lock. The database uses the
+    rollback journal rather than WAL, whose shared memory only works on one host, so that the batch task queue can
+    share it on a network filesystem with working file locks (e.g. NFSv4). Intermediate steps are stored apart from
+    the answer as a zlib-compressed blob, and are only decoded when asked for. `export_jsonl` writes the `_answers.jsonl` format the rest of the tooling reads.
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers (run_id TEXT, task_id TEXT, entry TEXT, steps BLOB, created REAL, "
+                "PRIMARY KEY (run_id, task_id))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS)
+            conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_SECONDS * 1000)}")
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, run_id: str, entry: Dict[str, Any]) -> None:
+        """Store the answer `entry` of `run_id`, replacing a previous answer to the same task."""
+        entry = dict(entry)
+        steps = entry.pop("intermediate_steps", None)
+        blob = zlib.compress(json.dumps(steps, default=str).encode("utf-8")) if steps is not None else None
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (run_id, str(entry.get("task_id")), json.dumps(entry, default=str), blob, time.time()),
+            )
+
+    def run_ids(self) -> List[str]:
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT run_id FROM answers")]
+
+    def done_task_ids(self, run_id: str) -> Set[str]:
+        rows = self._connection().execute("SELECT task_id FROM answers WHERE run_id = ?", (run_id,))
+        return {task_id for (task_id,) in rows}
+
+    def is_done(self, run_id: str, task_id: str) -> bool:
+        row = self._connection().execute(
+            "SELECT 1 FROM answers WHERE run_id = ? AND task_id = ?", (run_id, str(task_id))
+        ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def _decode(entry: str, steps: Optional[bytes], with_steps: bool) -> Dict[str, Any]:
+        decoded = json.loads(entry)
+        if with_steps:
+            decoded["intermediate_steps"] = json.loads(zlib.decompress(steps)) if steps is not None else None
+        return decoded
+
+    def get(self, run_id: str, task_id: str, with_steps: bool = True) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT entry, steps FROM answers WHERE run_id = ? AND task_id = ?", (run_id, str(task_id))
+        ).fetchone()
+        return self._decode(*row, with_steps) if row is not None else None
+
+    def iter_entries(self, run_id: str, with_steps: bool = True, since: float = 0) -> Iterator[Dict[str, Any]]:
+        """Yield the answers of `run_id` stored after `since`, oldest first."""
+        rows = self._connection().execute(
+            f"SELECT entry, {'steps' if with_steps else 'NULL'} FROM answers WHERE run_id = ? AND created > ? "
+            "ORDER BY created",
+            (run_id, since),
+        )
+        for entry, steps in rows:
+            yield self._decode(entry, steps, with_steps)
+
+    def iter_updates(self, run_id: str, since: float = 0) -> Iterator[Tuple[float, Dict[str, Any]]]:
+        """Yield `(created, answer)` for the answers of `run_id` stored after `since`, without their steps."""
+        rows = self._connection().execute(
+            "SELECT created, entry FROM answers WHERE run_id = ? AND created > ? ORDER BY created", (run_id, since)
+        )
+        for created, entry in rows:
+            yield created, json.loads(entry)
+
+    def import_jsonl(self, run_id: str, jsonl_file: str) -> int:
+        """Load the answers of an existing `_answers.jsonl` file, e.g. from a run started before this store."""
+        count = 0
+        with open(jsonl_file, encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    self.add(run_id, json.loads(line))
+                    count += 1
+        return count
+
+    def export_jsonl(self, run_id: str, jsonl_file: str) -> int:
+        jsonl_file = Path(jsonl_file)
+        jsonl_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = jsonl_file.with_suffix(".jsonl.tmp")
+        count = 0
+        with open(temp_file, "w", encoding="utf-8") as fp:
+            for entry in self.iter_entries(run_id):
+                fp.write(json.dumps(entry) + "\n")
+                count += 1
+        os.replace(temp_file, jsonl_file)
+        return count
@@ -2,11 +2,21 @@ import json
 import os
 import shutil
 import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Dict, List
 
 # import tqdm.asyncio
 from smolagents.utils import AgentError
 
+from .cache import get_cache, hash_file, make_key
+
+
+# Describing an attachment is one model call for documents, one vision call for images
+DOCUMENT_DESCRIPTION_WORKERS = int(os.getenv("DOCUMENT_DESCRIPTION_WORKERS", 8))
+VISION_DESCRIPTION_WORKERS = int(os.getenv("VISION_DESCRIPTION_WORKERS", 4))
+
 
 def serialize_agent_error(obj):
     if isinstance(obj, AgentError):
@@ -52,32 +62,141 @@ def get_single_file_description(file_path: str, question: str, visual_inspection
         return f" - Attached file: {file_path}"
 
 
-def get_zip_description(file_path: str, question: str, visual_inspection_tool, document_inspection_tool):
+def unpack_zip(file_path: str) -> List[str]:
+    """Extract a zip attachment next to it and return the paths of its files."""
     folder_path = file_path.replace(".zip", "")
     os.makedirs(folder_path, exist_ok=True)
     shutil.unpack_archive(file_path, folder_path)
+    return [os.path.join(root, file) for root, dirs, files in os.walk(folder_path) for file in files]
+
+
+def format_zip_description(file_descriptions: List[str]) -> str:
+    return "".join("\n" + textwrap.indent(description, prefix="    ") for description in file_descriptions)
+
+
+def get_zip_description(file_path: str, question: str, visual_inspection_tool, document_inspection_tool):
+    return format_zip_description(
+        [
+            get_single_file_description(file_path, question, visual_inspection_tool, document_inspection_tool)
+            for file_path in unpack_zip(file_path)
+        ]
+    )
+
+
+def format_attachments_prompt(file_name: str, description: str) -> str:
+    if ".zip" in file_name:
+        return "\n\nTo solve the task above, you will have to use these attached files:\n" + description
+    return "\n\nTo solve the task above, you will have to use this attached file:" + description
+
+
+def get_attachments_prompt(example: Dict, visual_inspection_tool, document_inspection_tool) -> str:
+    """The part of the task prompt that describes the attached file of `example`, if any."""
+    if not example.get("file_name"):
+        return ""
+    describe = get_zip_description if ".zip" in example["file_name"] else get_single_file_description
+    description = describe(example["file_name"], example["question"], visual_inspection_tool, document_inspection_tool)
+    return format_attachments_prompt(example["file_name"], description)
+
 
-    prompt_use_files = ""
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-            prompt_use_files += "\n" + textwrap.indent(
-                get_single_file_description(file_path, question, visual_inspection_tool, document_inspection_tool),
-                prefix="    ",
+def _attachments_cache_key(example: Dict) -> str:
+    return make_key("attachments_prompt", example["file_name"], hash_file(example["file_name"]), example["question"])
+
+
+def get_cached_attachments_prompt(example: Dict, visual_inspection_tool, document_inspection_tool) -> str:
+    """`get_attachments_prompt`, reusing the description computed by `describe_attachments` or an earlier run."""
+    if not example.get("file_name"):
+        return ""
+    return get_cache("attachment_descriptions").get_or_compute(
+        _attachments_cache_key(example),
+        lambda: get_attachments_prompt(example, visual_inspection_tool, document_inspection_tool),
+    )
+
+
+def _needs_vision(file_path: str) -> bool:
+    extension = file_path.split(".")[-1]
+    return extension in ["png", "jpg", "jpeg"] or os.path.exists(file_path.split(".")[0] + ".png")
+
+
+def describe_attachments(
+    examples: List[Dict],
+    visual_inspection_tool,
+    document_inspection_tool,
+    document_workers: int = DOCUMENT_DESCRIPTION_WORKERS,
+    vision_workers: int = VISION_DESCRIPTION_WORKERS,
+) -> int:
+    """Describe the attachments of `examples` ahead of their runs, into the cache `get_cached_attachments_prompt` reads.
+
+    Files, including those inside zip attachments, are described concurrently: images on a pool of `vision_workers`,
+    other documents on a pool of `document_workers`. Each prompt is computed through `get_or_compute` under the key the
+    runs use, so a run reaching a task still being described waits for its description instead of computing another.
+    Returns the number of attachment prompts computed.
+    """
+    cache = get_cache("attachment_descriptions")
+    pending = {}
+    for example in examples:
+        if example.get("file_name") and os.path.exists(example["file_name"]):
+            key = _attachments_cache_key(example)
+            # The miss is counted by get_or_compute below
+            if cache.peek(key) is None:
+                pending[key] = example
+    if not pending:
+        return 0
+
+    start = time.time()
+    computed = []
+    with (
+        ThreadPoolExecutor(max_workers=document_workers) as document_pool,
+        ThreadPoolExecutor(max_workers=vision_workers) as vision_pool,
+        # One waiting thread per attachment, so that every key is locked right away
+        ThreadPoolExecutor(max_workers=len(pending)) as attachment_pool,
+    ):
+
+        def describe(file_path: str, question: str):
+            pool = vision_pool if _needs_vision(file_path) else document_pool
+            return pool.submit(
+                get_single_file_description, file_path, question, visual_inspection_tool, document_inspection_tool
             )
-    return prompt_use_files
+
+        def compute(example: Dict) -> str:
+            if ".zip" in example["file_name"]:
+                futures = [describe(file_path, example["question"]) for file_path in unpack_zip(example["file_name"])]
+                description = format_zip_description([future.result() for future in futures])
+            else:
+                description = describe(example["file_name"], example["question"]).result()
+            computed.append(example["file_name"])
+            return format_attachments_prompt(example["file_name"], description)
+
+        def prepare(key: str, example: Dict) -> None:
+            try:
+                cache.get_or_compute(key, lambda: compute(example))
+            except Exception as e:
+                # Left to the run itself, which retries it
+                print(f"Could not describe the attachment of task {example.get('task_id')}: {e}")
+
+        for future in [attachment_pool.submit(prepare, key, example) for key, example in pending.items()]:
+            future.result()
+    print(f"Described {len(computed)}/{len(pending)} attachments in {time.time() - start:.1f}s")
+    return len(computed)
 
 
-def get_tasks_to_run(data, total: int, base_filename: Path, tasks_ids: list[int]):
+def get_tasks_to_run(data, total: int, base_filename: Path, tasks_ids: list[str], results_store=None):
     f = base_filename.parent / f"{base_filename.stem}_answers.jsonl"
     done = set()
-    if f.exists():
+    if results_store is not None:
+        run_id = base_filename.name
+        done = results_store.done_task_ids(run_id)
+        if not done and f.exists():
+            print(f"Importing {results_store.import_jsonl(run_id, f)} answers from {f}")
+            done = results_store.done_task_ids(run_id)
+    elif f.exists():
         with open(f, encoding="utf-8") as fh:
-            done = {json.loads(line)["task_id"] for line in fh if line.strip()}
+            done = {str(json.loads(line)["task_id"]) for line in fh if line.strip()}
 
+    # GAIA task ids are UUID strings
+    tasks_ids = {str(task_id) for task_id in tasks_ids} if tasks_ids is not None else None
     tasks = []
     for i in range(total):
-        task_id = int(data[i]["task_id"])
+        task_id = str(data[i]["task_id"])
         if task_id not in done:
             if tasks_ids is not None:
                 if task_id in tasks_ids:
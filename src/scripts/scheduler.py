@@ -0,0 +1,130 @@
+import glob
+import heapq
+import json
+import os
+import statistics
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from .results_store import ResultsStore, answer_seconds
+
+
+# Seconds per question before any history is available, roughly what o1 takes on the validation set
+DEFAULT_LEVEL_SECONDS = {"1": 300.0, "2": 600.0, "3": 1200.0}
+# Attachments add a description pass and usually more inspection steps
+ATTACHMENT_FACTORS = {"image": 1.2, "document": 1.3, "audio": 1.1, "zip": 1.5, "file": 1.1}
+SECONDS_PER_ATTACHMENT_MB = 10.0
+
+
+def attachment_kind(file_name: str) -> Optional[str]:
+    if not file_name:
+        return None
+    extension = file_name.split(".")[-1].lower()
+    if ".zip" in file_name:
+        return "zip"
+    if extension in ["png", "jpg", "jpeg"]:
+        return "image"
+    if extension in ["pdf", "xls", "xlsx", "docx", "doc", "xml", "pptx", "csv", "txt", "json", "py"]:
+        return "document"
+    if extension in ["mp3", "m4a", "wav"]:
+        return "audio"
+    return "file"
+
+
+class RuntimeHistory:
+    """Past answering times, per task and per level, from results stores and `_answers.jsonl` files."""
+
+    def __init__(self):
+        self.task_seconds: Dict[str, List[float]] = defaultdict(list)
+        self.level_seconds: Dict[str, List[float]] = defaultdict(list)
+
+    def add(self, entry: Dict) -> None:
+        seconds = answer_seconds(entry)
+        if seconds is None or seconds <= 0:
+            return
+        self.task_seconds[str(entry.get("task_id"))].append(seconds)
+        self.level_seconds[str(entry.get("task"))].append(seconds)
+
+    def add_store(self, results_store: ResultsStore) -> None:
+        for run_id in results_store.run_ids():
+            for entry in results_store.iter_entries(run_id, with_steps=False):
+                self.add(entry)
+
+    def add_jsonl(self, jsonl_file: str) -> None:
+        with open(jsonl_file, encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    self.add(json.loads(line))
+
+    @classmethod
+    def load(cls, output_dir: str, results_store: Optional[ResultsStore] = None) -> "RuntimeHistory":
+        """Read the answers of every earlier run in `output_dir`: the results store, or else the answers files."""
+        history = cls()
+        if results_store is not None and results_store.run_ids():
+            history.add_store(results_store)
+        else:
+            for jsonl_file in glob.glob(os.path.join(output_dir, "*_answers.jsonl")):
+                history.add_jsonl(jsonl_file)
+        return history
+
+    def __len__(self) -> int:
+        return sum(len(seconds) for seconds in self.task_seconds.values())
+
+
+def estimate_seconds(example: Dict, history: RuntimeHistory) -> float:
+    """Expected time to answer `example`: its median past runtime, else a per-level baseline scaled by its attachment."""
+    past = history.task_seconds.get(str(example["task_id"]))
+    if past:
+        return statistics.median(past)
+    level = str(example.get("task"))
+    if history.level_seconds.get(level):
+        seconds = statistics.median(history.level_seconds[level])
+    else:
+        seconds = DEFAULT_LEVEL_SECONDS.get(level, max(DEFAULT_LEVEL_SECONDS.values()))
+    kind = attachment_kind(example.get("file_name"))
+    if kind is not None:
+        seconds *= ATTACHMENT_FACTORS[kind]
+        if os.path.exists(example["file_name"]):
+            seconds += SECONDS_PER_ATTACHMENT_MB * os.path.getsize(example["file_name"]) / 1024**2
+    return seconds
+
+
+def predict_makespan(estimates: Iterable[float], workers: int) -> float:
+    """Time until the last task finishes when each free worker takes the next task, in the given order."""
+    finish_times = [0.0] * max(workers, 1)
+    for seconds in estimates:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + seconds)
+    return max(finish_times)
+
+
+class Schedule:
+    """Longest-expected-first order for a batch, with the makespan it should take."""
+
+    def __init__(self, examples: List[Dict], history: RuntimeHistory, workers: int):
+        self.workers = workers
+        self.estimates = {str(example["task_id"]): estimate_seconds(example, history) for example in examples}
+        self.dataset_order_makespan = predict_makespan(self.estimates.values(), workers)
+        self.predicted_makespan = predict_makespan(sorted(self.estimates.values(), reverse=True), workers)
+
+    def priorities(self) -> Dict[str, float]:
+        """For `TaskQueue.enqueue`, which hands out higher priorities first."""
+        return dict(self.estimates)
+
+    def describe(self) -> str:
+        return (
+            f"Scheduled {len(self.estimates)} tasks longest-first on {self.workers} workers: predicted makespan "
+            f"{self.predicted_makespan / 60:.1f} min, against {self.dataset_order_makespan / 60:.1f} min in dataset order"
+        )
+
+    def report(self, actual_makespan: float, actual_seconds: Dict[str, float]) -> Dict:
+        """Predicted against actual makespan, and how far off the per-task estimates were."""
+        ratios = [
+            seconds / self.estimates[task_id] for task_id, seconds in actual_seconds.items() if task_id in self.estimates
+        ]
+        return {
+            "workers": self.workers,
+            "predicted_makespan": self.predicted_makespan,
+            "dataset_order_makespan": self.dataset_order_makespan,
+            "actual_makespan": actual_makespan,
+            "median_actual_to_estimate": statistics.median(ratios) if ratios else None,
+        }
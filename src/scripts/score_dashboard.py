@@ -0,0 +1,231 @@
+"""Live scores of a running evaluation, updated as answers come in.
+
+Follows either an `_answers.jsonl` file (reading only the lines appended since the last poll) or the SQLite results
+store of a batch run, scores each new answer once with `question_scorer`, and shows running accuracy per level with
+latency and token percentiles, in the terminal or as a self-refreshing HTML page. Run from `src/`, e.g.
+
+    python -m scripts.score_dashboard output/validation/my_run_answers.jsonl
+    python -m scripts.score_dashboard --store output/validation/results.sqlite --run-id my_run --html scores.html
+"""
+
+import argparse
+import contextlib
+import html
+import io
+import json
+import os
+import time
+import warnings
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .gaia_scorer import question_scorer
+from .results_store import ResultsStore, answer_seconds
+
+
+REFRESH_SECONDS = 10
+PERCENTILES = (50, 90, 99)
+# Answers stored this long before the latest one seen are read again, in case they were committed out of order
+STORE_POLL_OVERLAP = 60
+
+
+class AnswersFileFollower:
+    """Reads the answers appended to a JSONL file since the previous poll."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+
+    def poll(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        if os.path.getsize(self.path) < self.offset:
+            # Rewritten from scratch, e.g. by `ResultsStore.export_jsonl`
+            self.offset = 0
+        with open(self.path, "rb") as fp:
+            fp.seek(self.offset)
+            data = fp.read()
+        # A line still being written is left for the next poll
+        complete = data[: data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        return [json.loads(line) for line in complete.decode("utf-8").splitlines() if line.strip()]
+
+
+class ResultsStoreFollower:
+    """Reads the answers of one run added to a `ResultsStore` since the previous poll."""
+
+    def __init__(self, path: str, run_id: str):
+        self.store = ResultsStore(path)
+        self.run_id = run_id
+        self.since = 0.0
+        self.seen = set()
+
+    def poll(self) -> List[Dict[str, Any]]:
+        entries = []
+        latest = self.since
+        for created, entry in self.store.iter_updates(self.run_id, since=max(self.since - STORE_POLL_OVERLAP, 0)):
+            latest = max(latest, created)
+            key = (str(entry.get("task_id")), created)
+            if key not in self.seen:
+                self.seen.add(key)
+                entries.append(entry)
+        self.since = latest
+        return entries
+
+
+def _tokens(entry: Dict[str, Any]) -> Optional[int]:
+    ledger = entry.get("ledger")
+    if not ledger:
+        return None
+    return ledger.get("input_tokens", 0) + ledger.get("output_tokens", 0)
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+class LiveScoreboard:
+    """Running scores, updated one answer at a time.
+
+    Latencies and token counts are kept sorted, so percentiles never need a pass over past answers. An answer to a
+    task already seen (e.g. a rerun) replaces the previous one.
+    """
+
+    def __init__(self):
+        self.answers: Dict[str, Dict[str, Any]] = {}
+        self.levels = defaultdict(lambda: {"answered": 0, "scored": 0, "correct": 0, "errors": 0})
+        self.latencies: List[float] = []
+        self.tokens: List[int] = []
+        self.started = time.time()
+
+    def _apply(self, answer: Dict[str, Any], sign: int) -> None:
+        level = self.levels[answer["level"]]
+        level["answered"] += sign
+        level["scored"] += sign * (answer["correct"] is not None)
+        level["correct"] += sign * bool(answer["correct"])
+        level["errors"] += sign * answer["error"]
+        for values, value in ((self.latencies, answer["latency"]), (self.tokens, answer["tokens"])):
+            if value is None:
+                continue
+            if sign > 0:
+                insort(values, value)
+            else:
+                del values[bisect_left(values, value)]
+
+    def add(self, entry: Dict[str, Any]) -> None:
+        correct = None
+        if entry.get("true_answer") is not None:
+            # The scalar scorer prints and warns on every odd answer, which would scroll the dashboard away
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                correct = question_scorer(str(entry.get("prediction")), str(entry["true_answer"]))
+        answer = {
+            "level": str(entry.get("task")),
+            "correct": correct,
+            "error": bool(entry.get("agent_error") or entry.get("parsing_error") or entry.get("iteration_limit_exceeded")),
+            "latency": answer_seconds(entry),
+            "tokens": _tokens(entry),
+        }
+        task_id = str(entry.get("task_id"))
+        if task_id in self.answers:
+            self._apply(self.answers[task_id], -1)
+        self.answers[task_id] = answer
+        self._apply(answer, 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        rows = {level: dict(counts) for level, counts in sorted(self.levels.items()) if counts["answered"]}
+        total = {key: sum(row[key] for row in rows.values()) for key in ("answered", "scored", "correct", "errors")}
+        for row in [*rows.values(), total]:
+            row["accuracy"] = row["correct"] / row["scored"] if row["scored"] else None
+        return {
+            "levels": rows,
+            "total": total,
+            "latency": {p: _percentile(self.latencies, p) for p in PERCENTILES},
+            "tokens": {p: _percentile(self.tokens, p) for p in PERCENTILES},
+            "elapsed": time.time() - self.started,
+        }
+
+
+def _format(value: Optional[float], pattern: str) -> str:
+    return "-" if value is None else pattern.format(value)
+
+
+def render_text(snapshot: Dict[str, Any], source: str) -> str:
+    lines = [
+        f"Scores of {source} at {datetime.now():%H:%M:%S}",
+        "",
+        f"{'level':<8} {'answered':>9} {'scored':>7} {'correct':>8} {'accuracy':>9} {'errors':>7}",
+    ]
+    for level, row in [*snapshot["levels"].items(), ("all", snapshot["total"])]:
+        lines.append(
+            f"{level:<8} {row['answered']:>9} {row['scored']:>7} {row['correct']:>8} "
+            f"{_format(row['accuracy'], '{:.1%}'):>9} {row['errors']:>7}"
+        )
+    lines.append("")
+    for name, unit, pattern in (("latency", "s", "{:.0f}"), ("tokens", "", "{:,.0f}")):
+        percentiles = ", ".join(f"p{p} {_format(v, pattern)}{unit}" for p, v in snapshot[name].items())
+        lines.append(f"{name:<8} {percentiles}")
+    return "\n".join(lines)
+
+
+def render_html(snapshot: Dict[str, Any], source: str, refresh_seconds: int = REFRESH_SECONDS) -> str:
+    text = html.escape(render_text(snapshot, source))
+    return (
+        f'<!DOCTYPE html>\n<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="{refresh_seconds}">'
+        f"<title>Scores of {html.escape(source)}</title></head>\n<body><pre>{text}</pre></body></html>\n"
+    )
+
+
+def write_atomically(path: str, content: str) -> None:
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as fp:
+        fp.write(content)
+    os.replace(temp_path, path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Live scores of a running evaluation.")
+    parser.add_argument("answers_file", type=str, nargs="?", default=None, help="The `_answers.jsonl` file to follow.")
+    parser.add_argument("--store", type=str, default=None, help="Follow this results store instead of a file.")
+    parser.add_argument("--run-id", type=str, default=None, help="Run to follow in --store.")
+    parser.add_argument("--interval", type=float, default=REFRESH_SECONDS, help="Seconds between polls.")
+    parser.add_argument("--html", type=str, default=None, help="Write an HTML page here instead of using the terminal.")
+    parser.add_argument("--once", action="store_true", help="Score what is there and exit.")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.store:
+        if not args.run_id:
+            raise ValueError("--store needs a --run-id.")
+        follower, source = ResultsStoreFollower(args.store, args.run_id), f"{args.store} ({args.run_id})"
+    elif args.answers_file:
+        follower, source = AnswersFileFollower(args.answers_file), args.answers_file
+    else:
+        raise ValueError("Give an answers file or --store.")
+
+    scoreboard = LiveScoreboard()
+    while True:
+        for entry in follower.poll():
+            scoreboard.add(entry)
+        snapshot = scoreboard.snapshot()
+        if args.html:
+            write_atomically(args.html, render_html(snapshot, source, refresh_seconds=max(int(args.interval), 1)))
+        else:
+            # Redraw in place
+            print(("" if args.once else "\033[H\033[J") + render_text(snapshot, source), flush=True)
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,83 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List
+
+from smolagents import Tool
+
+
+SEARCH_POOL_SIZE = 3
+# Shared by every pool of the process, so that concurrent questions cannot multiply the number of running sub-agents
+MAX_CONCURRENT_SEARCH_AGENTS = int(os.getenv("MAX_CONCURRENT_SEARCH_AGENTS", 8))
+search_agent_slots = threading.BoundedSemaphore(MAX_CONCURRENT_SEARCH_AGENTS)
+
+
+class SearchAgentPool:
+    """Search agents built on demand by `factory`, up to `size`, and reused across sub-questions.
+
+    Agents should be built with a sub-agent budget, which each sub-question gets in full.
+    """
+
+    def __init__(self, factory: Callable, size: int = SEARCH_POOL_SIZE):
+        self.factory = factory
+        self.size = size
+        self._idle: queue.Queue = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        try:
+            agent = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            agent = self.factory() if create else self._idle.get()
+        try:
+            yield agent
+        finally:
+            self._idle.put(agent)
+
+    def ask(self, request: str) -> str:
+        # Take a global slot only once one of our agents is free: waiting for an agent while holding a slot would keep
+        # the slot from the other pools
+        with self.acquire() as agent, search_agent_slots:
+            return str(agent(request))
+
+
+class ParallelSearchTool(Tool):
+    name = "parallel_search"
+    description = """Research several independent questions at the same time, each with its own web search agent, and return all their reports.
+Use it when a task splits into sub-questions that do not depend on each other, like finding facts about A and about B to compare them.
+Each request must be a real sentence with all the context needed, like the requests you make to search_agent."""
+    inputs = {
+        "requests": {
+            "type": "array",
+            "description": "The independent research requests, one string per sub-question.",
+        }
+    }
+    output_type = "string"
+
+    def __init__(self, pool: SearchAgentPool):
+        super().__init__()
+        self.pool = pool
+
+    def forward(self, requests: List[str]) -> str:
+        if isinstance(requests, str):
+            requests = [requests]
+
+        def ask(request: str) -> str:
+            try:
+                return self.pool.ask(request)
+            except Exception as e:
+                return f"Error: {e}"
+
+        with ThreadPoolExecutor(max_workers=max(len(requests), 1)) as executor:
+            reports = list(executor.map(ask, requests))
+        return "\n\n".join(
+            f"### Request {i + 1}: {request}\n{report}" for i, (request, report) in enumerate(zip(requests, reports))
+        )
@@ -0,0 +1,81 @@
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+from .answer_normalizer import normalize_final_answer
+from .cache import normalize_question
+
+
+def vote_key(answer: Optional[str], question: str = "") -> Optional[str]:
+    """The form under which two answers count as the same vote."""
+    if answer is None or not str(answer).strip():
+        return None
+    answer = str(answer)
+    normalized = normalize_question(normalize_final_answer(answer, question) or answer)
+    # "The Netherlands" and "Netherlands" are the same vote
+    return re.sub(r"[.!?\s]+$", "", re.sub(r"^(the|a|an)\s+", "", normalized))
+
+
+def run_self_consistency(
+    run_once: Callable[[threading.Event], Dict[str, Any]],
+    question: str,
+    samples: int,
+    quorum: int,
+    answer_field: str = "prediction",
+) -> Dict[str, Any]:
+    """Start `samples` independent runs of `run_once` and return as soon as `quorum` of their answers agree.
+
+    `run_once(cancel_event)` answers the question once and returns its annotated example; it must stop when
+    `cancel_event` is set, e.g. by giving it to every `ResearchToolCallingAgent` of its hierarchy. Without a quorum,
+    the most voted answer wins, ties going to the earliest answer. The cancelled runs are waited for before returning,
+    so that whatever they record on the way out (e.g. their costs) is in by then.
+    """
+    cancel_event = threading.Event()
+    results: List[Dict[str, Any]] = []
+    votes: Counter = Counter()
+    winner = None
+    executor = ThreadPoolExecutor(max_workers=samples)
+    try:
+        futures = [executor.submit(run_once, cancel_event) for _ in range(samples)]
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"> Self-consistency run failed: {e}")
+                continue
+            key = vote_key(result.get(answer_field), question)
+            results.append(result)
+            if key is None:
+                continue
+            votes[key] += 1
+            print(f"> Self-consistency: {len(results)}/{samples} runs done, votes {dict(votes)}")
+            if votes[key] >= quorum:
+                winner = result
+                break
+    finally:
+        # Stragglers stop at their next step: wait for them, so their costs land before the caller summarizes
+        cancel_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    if winner is None:
+        voted = [result for result in results if vote_key(result.get(answer_field), question) is not None]
+        if voted:
+            top_votes = max(votes.values())
+            winner = next(result for result in voted if votes[vote_key(result.get(answer_field), question)] == top_votes)
+        elif results:
+            winner = results[0]
+        else:
+            raise RuntimeError(f"All {samples} self-consistency runs failed.")
+
+    return {
+        **winner,
+        "self_consistency": {
+            "samples": samples,
+            "quorum": quorum,
+            "completed_runs": len(results),
+            "votes": dict(votes),
+            "reached_quorum": max(votes.values(), default=0) >= quorum,
+        },
+    }
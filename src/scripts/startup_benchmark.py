@@ -0,0 +1,45 @@
+"""Measure the cost of importing modules in a fresh interpreter.
+
+Run from `src/`, e.g. `python -m scripts.startup_benchmark scripts.visual_qa assistant`, once before and once after a
+change to compare import times.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+
+
+def time_import(module: str, repeat: int = 5) -> List[float]:
+    timings = []
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True, env=env, capture_output=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="+")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = statistics.median(time_import("sys", args.repeat))
+    print(f"{'module':<40} {'median (s)':>12} {'min (s)':>10}")
+    print(f"{'<interpreter startup>':<40} {baseline:>12.3f} {'':>10}")
+    for module in args.modules:
+        try:
+            timings = time_import(module, args.repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<40} failed to import: {e.stderr.decode().strip().splitlines()[-1]}")
+            continue
+        print(f"{module:<40} {statistics.median(timings):>12.3f} {min(timings):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+
+LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", 5 * 60))
+MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", 3))
+# How long a statement waits for another process holding the database lock
+BUSY_TIMEOUT_SECONDS = 30
+
+
+def task_hash(task_id: str) -> int:
+    """Stable across processes and machines, unlike `hash`."""
+    return zlib.crc32(str(task_id).encode("utf-8"))
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}"
+
+
+class TaskQueue:
+    """Tasks of an evaluation run in a SQLite database that several processes pull work from.
+
+    The database uses the rollback journal rather than WAL, whose shared memory only works on one host: processes on
+    several machines can share it on a network filesystem with working POSIX file locks (e.g. NFSv4 or a local
+    cluster filesystem). Filesystems with broken locking, such as NFSv3 without lockd or most FUSE mounts, corrupt it:
+    run every worker on one host there.
+
+    A worker leases a task for `lease_seconds` and keeps the lease alive with heartbeats while it works on it. When a
+    worker dies, its lease expires and the task goes to the next worker that asks. A task that fails `max_attempts`
+    times is set aside until the run is enqueued again. With `num_shards`, each worker takes the tasks of its own shard
+    first and only then helps with the others, so that workers started with different shards rarely contend.
+    """
+
+    def __init__(
+        self, path: str, run_id: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS
+    ):
+        self.path = str(path)
+        self.run_id = run_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS tasks (run_id TEXT, task_id TEXT, task_hash INTEGER, priority REAL, "
+            "state TEXT, worker TEXT, lease_expires REAL, attempts INTEGER, error TEXT, PRIMARY KEY (run_id, task_id))"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit: transactions are opened explicitly, with BEGIN IMMEDIATE where a read decides a write
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_SECONDS * 1000)}")
+            conn.execute("PRAGMA journal_mode=DELETE")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def enqueue(self, task_ids: Iterable[str], priorities: Optional[Dict[str, float]] = None) -> None:
+        """Add tasks, higher priorities first. Safe to call from every worker: queued tasks keep their state and get the
+        new priorities, and failed ones get a new set of attempts."""
+        priorities = priorities or {}
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO tasks VALUES (?, ?, ?, ?, 'pending', NULL, NULL, 0, NULL) "
+                "ON CONFLICT (run_id, task_id) DO UPDATE SET priority = excluded.priority, "
+                "attempts = CASE WHEN state = 'failed' THEN 0 ELSE attempts END, "
+                "state = CASE WHEN state = 'failed' THEN 'pending' ELSE state END",
+                [
+                    (self.run_id, str(task_id), task_hash(task_id), priorities.get(str(task_id), 0))
+                    for task_id in task_ids
+                ],
+            )
+
+    def lease(self, worker_id: str, shard: int = 0, num_shards: int = 1) -> Optional[str]:
+        """Take the next available task, pending or with an expired lease, or return None when there is none."""
+        now = time.time()
+        with self._transaction() as conn:
+            # Whoever held the last attempt died with it
+            conn.execute(
+                "UPDATE tasks SET state = 'failed', error = 'Lease expired' "
+                "WHERE run_id = ? AND state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (self.run_id, now, self.max_attempts),
+            )
+            available = (
+                "SELECT task_id FROM tasks WHERE run_id = ? AND attempts < ? "
+                "AND (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+            )
+            order = "ORDER BY priority DESC, rowid LIMIT 1"
+            row = conn.execute(
+                available + "AND task_hash % ? = ? " + order, (self.run_id, self.max_attempts, now, num_shards, shard)
+            ).fetchone()
+            if row is None and num_shards > 1:
+                row = conn.execute(available + order, (self.run_id, self.max_attempts, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE run_id = ? AND task_id = ?",
+                (worker_id, now + self.lease_seconds, self.run_id, row[0]),
+            )
+        return row[0]
+
+    def next_task(self, worker_id: str, shard: int = 0, num_shards: int = 1, poll_seconds: float = 10) -> Optional[str]:
+        """Lease the next task, waiting while other workers hold leases, which expire if they die. Returns None once
+        every task is done or failed."""
+        while True:
+            task_id = self.lease(worker_id, shard, num_shards)
+            if task_id is not None or not self.counts().get("leased"):
+                return task_id
+            time.sleep(poll_seconds)
+
+    def heartbeat(self, task_id: str, worker_id: str) -> bool:
+        """Extend the lease; False if the task is no longer leased to `worker_id`."""
+        cursor = self._connection().execute(
+            "UPDATE tasks SET lease_expires = ? WHERE run_id = ? AND task_id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + self.lease_seconds, self.run_id, str(task_id), worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: str, worker_id: str) -> None:
+        self._connection().execute(
+            "UPDATE tasks SET state = 'done', lease_expires = NULL, error = NULL WHERE run_id = ? AND task_id = ?",
+            (self.run_id, str(task_id)),
+        )
+
+    def fail(self, task_id: str, worker_id: str, error: str) -> None:
+        """Release the task for another attempt, or set it aside after `max_attempts`."""
+        self._connection().execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_expires = NULL, error = ? WHERE run_id = ? AND task_id = ? AND worker = ?",
+            (self.max_attempts, error, self.run_id, str(task_id), worker_id),
+        )
+
+    @contextmanager
+    def keep_alive(self, task_id: str, worker_id: str):
+        """Heartbeat the lease from a background thread while the block runs."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                if not self.heartbeat(task_id, worker_id):
+                    print(f"Lost the lease of task {task_id}, another worker may answer it too.")
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connection().execute(
+            "SELECT state, COUNT(*) FROM tasks WHERE run_id = ? GROUP BY state", (self.run_id,)
+        )
+        return dict(rows.fetchall())
@@ -1,9 +1,28 @@
+import threading
 from typing import Optional
 
 from smolagents import Tool
 from smolagents.models import MessageRole, Model
 
-from .mdconvert import MarkdownConverter
+from .cache import get_cache, hash_file, make_key, normalize_question
+
+
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+
+_md_converter = None
+_md_converter_lock = threading.Lock()
+
+
+def markdown_converter():
+    """The converter shared by every instance, built on first use: importing it pulls pdfminer, pptx, pandas, pydub
+    and speech recognition, which entry points that never read a file should not pay for."""
+    global _md_converter
+    with _md_converter_lock:
+        if _md_converter is None:
+            from .mdconvert import MarkdownConverter
+
+            _md_converter = MarkdownConverter()
+        return _md_converter
 
 
 class TextInspectorTool(Tool):
@@ -24,15 +43,36 @@ This tool handles the following file extensions: [".html", ".htm", ".xlsx", ".pp
         },
     }
     output_type = "string"
-    md_converter = MarkdownConverter()
 
-    def __init__(self, model: Model, text_limit: int):
+    def __init__(self, model: Model, text_limit: int, use_cache: bool = True):
         super().__init__()
         self.model = model
         self.text_limit = text_limit
+        # Shared by every instance in the process, so the manager and the search_agent reuse each other's answers
+        self.answer_cache = get_cache("text_inspector_answers", ttl=ANSWER_CACHE_TTL) if use_cache else None
+
+    def _cached(self, mode: str, file_path: str, question: str, compute):
+        if self.answer_cache is None or not question:
+            return compute()
+        key = make_key(
+            mode,
+            hash_file(file_path),
+            normalize_question(question),
+            getattr(self.model, "model_id", None),
+            self.text_limit,
+        )
+        return self.answer_cache.get_or_compute(key, compute)
 
     def forward_initial_exam_mode(self, file_path, question):
-        result = self.md_converter.convert(file_path)
+        return self._cached(
+            "initial_exam", file_path, question, lambda: self._forward_initial_exam_mode(file_path, question)
+        )
+
+    def forward(self, file_path, question: Optional[str] = None) -> str:
+        return self._cached("answer", file_path, question, lambda: self._forward(file_path, question))
+
+    def _forward_initial_exam_mode(self, file_path, question):
+        result = markdown_converter().convert(file_path)
 
         if file_path[-4:] in [".png", ".jpg"]:
             raise Exception("Cannot use inspect_file_as_text tool with images: use visualizer instead!")
@@ -73,8 +113,8 @@ This tool handles the following file extensions: [".html", ".htm", ".xlsx", ".pp
         ]
         return self.model(messages).content
 
-    def forward(self, file_path, question: Optional[str] = None) -> str:
-        result = self.md_converter.convert(file_path)
+    def _forward(self, file_path, question: Optional[str] = None) -> str:
+        result = markdown_converter().convert(file_path)
 
         if file_path[-4:] in [".png", ".jpg"]:
             raise Exception("Cannot use inspect_file_as_text tool with images: use visualizer instead!")
@@ -1,11 +1,15 @@
 # Shamelessly stolen from Microsoft Autogen team: thanks to them for this great resource!
 # https://github.com/microsoft/autogen/blob/gaia_multiagent_v01_march_1st/autogen/browser_utils.py
+import copy
+import json
 import mimetypes
 import os
 import pathlib
 import re
+import threading
 import time
 import uuid
+from contextlib import contextmanager
 from typing import Any, Dict, List, Optional, Tuple, Union
 from urllib.parse import unquote, urljoin, urlparse
 
@@ -15,8 +19,13 @@ from serpapi import GoogleSearch
 
 from smolagents import Tool
 
+from .cache import get_cache, make_key
 from .cookies import COOKIES
-from .mdconvert import FileConversionException, MarkdownConverter, UnsupportedFormatException
+
+
+# Search results and fetched pages are shared by every browser of the process, e.g. by concurrent runs of a question
+SERP_CACHE_TTL = 24 * 3600
+PAGE_CACHE_ENTRIES = 256
 
 
 class SimpleTextBrowser:
@@ -41,8 +50,9 @@ class SimpleTextBrowser:
         self.serpapi_key = serpapi_key
         self.request_kwargs = request_kwargs
         self.request_kwargs["cookies"] = COOKIES
-        self._mdconvert = MarkdownConverter()
+        self._converter = None
         self._page_content: str = ""
+        self.bytes_fetched = 0  # Network bytes received, for cost accounting
 
         self._find_on_page_query: Union[str, None] = None
         self._find_on_page_last_result: Union[int, None] = None  # Location of the last result
@@ -213,11 +223,17 @@ class SimpleTextBrowser:
         if filter_year is not None:
             params["tbs"] = f"cdr:1,cd_min:01/01/{filter_year},cd_max:12/31/{filter_year}"
 
-        search = GoogleSearch(params)
-        results = search.get_dict()
+        def search() -> Dict[str, Any]:
+            results = GoogleSearch(params).get_dict()
+            self.bytes_fetched += len(json.dumps(results))
+            if "organic_results" not in results.keys():
+                # Raised before caching, so that failed searches are retried
+                raise Exception(f"No results found for query: '{query}'. Use a less specific query.")
+            return results
+
         self.page_title = f"{query} - Search"
-        if "organic_results" not in results.keys():
-            raise Exception(f"No results found for query: '{query}'. Use a less specific query.")
+        serp_cache = get_cache("serp_results", ttl=SERP_CACHE_TTL)
+        results = serp_cache.get_or_compute(make_key(query, filter_year), search)
         if len(results["organic_results"]) == 0:
             year_filter_message = f" with filter year={filter_year}" if filter_year is not None else ""
             self._set_page_content(
@@ -273,7 +289,18 @@ class SimpleTextBrowser:
 
         self._set_page_content(content)
 
+    @property
+    def _mdconvert(self):
+        # Built on first use, like its heavy converter dependencies
+        if self._converter is None:
+            from .mdconvert import MarkdownConverter
+
+            self._converter = MarkdownConverter()
+        return self._converter
+
     def _fetch_page(self, url: str) -> None:
+        from .mdconvert import FileConversionException, UnsupportedFormatException
+
         download_path = ""
         try:
             if url.startswith("file://"):
@@ -282,6 +309,13 @@ class SimpleTextBrowser:
                 self.page_title = res.title
                 self._set_page_content(res.text_content)
             else:
+                page_cache = get_cache("fetched_pages", persistent=False, max_entries=PAGE_CACHE_ENTRIES)
+                cached_page = page_cache.get(url)
+                if cached_page is not None:
+                    self.page_title = cached_page["title"]
+                    self._set_page_content(cached_page["text_content"])
+                    return
+
                 # Prepare the request parameters
                 request_kwargs = self.request_kwargs.copy() if self.request_kwargs is not None else {}
                 request_kwargs["stream"] = True
@@ -292,12 +326,17 @@ class SimpleTextBrowser:
 
                 # If the HTTP request was successful
                 content_type = response.headers.get("content-type", "")
+                content_length = int(response.headers.get("content-length") or 0)
+                self.bytes_fetched += content_length
 
                 # Text or HTML
                 if "text/" in content_type.lower():
                     res = self._mdconvert.convert_response(response)
+                    if not content_length:
+                        self.bytes_fetched += len(res.text_content)
                     self.page_title = res.title
                     self._set_page_content(res.text_content)
+                    page_cache.set(url, {"title": res.title, "text_content": res.text_content})
                 # A download
                 else:
                     # Try producing a safe filename
@@ -329,6 +368,8 @@ class SimpleTextBrowser:
                     with open(download_path, "wb") as fh:
                         for chunk in response.iter_content(chunk_size=512):
                             fh.write(chunk)
+                            if not content_length:
+                                self.bytes_fetched += len(chunk)
 
                     # Render it
                     local_uri = pathlib.Path(download_path).as_uri()
@@ -365,6 +406,49 @@ class SimpleTextBrowser:
                 self.page_title = "Error"
                 self._set_page_content(f"## Error\n\n{str(request_exception)}")
 
+    def fork(self) -> "SimpleTextBrowser":
+        """Return an independent tab that starts on the current page and shares nothing mutable with this browser."""
+        tab = copy.copy(self)
+        tab.history = list(self.history)
+        tab.viewport_pages = list(self.viewport_pages)
+        tab.request_kwargs = dict(self.request_kwargs) if self.request_kwargs is not None else None
+        tab.bytes_fetched = 0
+        tab._forked_at = len(self.history)
+        return tab
+
+    def merge_tab(self, tab: "SimpleTextBrowser", take_page: bool = False) -> None:
+        """Fold a tab created by `fork` back in: its history and byte count, and optionally its current page."""
+        self.history.extend(tab.history[tab._forked_at :])
+        self.bytes_fetched += tab.bytes_fetched
+        if take_page and len(tab.history) > tab._forked_at:
+            # The tab's latest visit is now the last history entry, so `address` already points to its page
+            self.page_title = tab.page_title
+            self._page_content = tab._page_content
+            self.viewport_pages = tab.viewport_pages
+            self.viewport_current_page = tab.viewport_current_page
+            self._find_on_page_query = tab._find_on_page_query
+            self._find_on_page_last_result = tab._find_on_page_last_result
+
+    STATE_ATTRIBUTES = (
+        "history",
+        "page_title",
+        "viewport_current_page",
+        "viewport_pages",
+        "_page_content",
+        "_find_on_page_query",
+        "_find_on_page_last_result",
+        "bytes_fetched",
+    )
+
+    def get_state(self) -> Dict[str, Any]:
+        """Return the navigation state (history, current page and viewport), e.g. to checkpoint it."""
+        return copy.deepcopy({name: getattr(self, name) for name in self.STATE_ATTRIBUTES})
+
+    def set_state(self, state: Dict[str, Any]) -> None:
+        for name in self.STATE_ATTRIBUTES:
+            if name in state:
+                setattr(self, name, copy.deepcopy(state[name]))
+
     def _state(self) -> Tuple[str, str]:
         header = f"Address: {self.address}\n"
         if self.page_title is not None:
@@ -383,6 +467,36 @@ class SimpleTextBrowser:
         return (header, self.viewport)
 
 
+class TabbedBrowser:
+    """Routes every browser access to the current thread's tab while one is open, and to the main browser otherwise.
+
+    Tools hold this proxy in place of the browser, so that tool calls running concurrently in `open_tab` contexts
+    never share page state.
+    """
+
+    def __init__(self, browser: SimpleTextBrowser):
+        object.__setattr__(self, "main", browser)
+        object.__setattr__(self, "_local", threading.local())
+
+    def _current(self) -> SimpleTextBrowser:
+        return getattr(self._local, "tab", None) or self.main
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._current(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._current(), name, value)
+
+    @contextmanager
+    def open_tab(self):
+        tab = self.main.fork()
+        self._local.tab = tab
+        try:
+            yield tab
+        finally:
+            self._local.tab = None
+
+
 class SearchInformationTool(Tool):
     name = "web_search"
     description = "Perform a web search query (think a google search) and returns the search results."
@@ -1,26 +1,72 @@
-import base64
 import json
 import mimetypes
 import os
+import re
+import threading
+import time
 import uuid
-from io import BytesIO
-from typing import Optional
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
 
 import requests
 from dotenv import load_dotenv
-from huggingface_hub import InferenceClient
-from PIL import Image
-from transformers import AutoProcessor
 
 from smolagents import Tool, tool
 
+from .cache import get_cache, hash_file, make_key, normalize_question
+from .image_preprocessing import DEFAULT_MAX_BYTES, DEFAULT_MAX_PIXELS, EncodedImage, prepare_image
+
 
 load_dotenv(override=True)
 
-idefics_processor = AutoProcessor.from_pretrained("HuggingFaceM4/idefics2-8b-chatty")
+IDEFICS_CHECKPOINT = "HuggingFaceM4/idefics2-8b-chatty"
+
+# Same layout as the idefics2 chat template, used when the processor cannot be loaded (e.g. offline)
+IDEFICS_FALLBACK_TEMPLATE = "User:<image>{query}<end_of_utterance>\nAssistant:"
+
+
+# After a failed load (e.g. the Hub is unreachable), the fallback template is used for this long before trying again
+PROCESSOR_RETRY_SECONDS = 5 * 60
+
+_processor_lock = threading.Lock()
+_processor_state = {"processor": None, "failed_at": None}
 
 
-def process_images_and_text(image_path, query, client):
+def get_idefics_processor():
+    """Load the idefics2 processor on first use: prefer the local HF cache, then the Hub.
+
+    Returns None if it cannot be loaded, in which case callers fall back to `IDEFICS_FALLBACK_TEMPLATE`. Only a
+    successful load is kept: a failed one is retried after `PROCESSOR_RETRY_SECONDS`.
+    """
+    try:
+        from transformers import AutoProcessor
+    except ImportError:
+        return None
+
+    with _processor_lock:
+        if _processor_state["processor"] is not None:
+            return _processor_state["processor"]
+        failed_at = _processor_state["failed_at"]
+        if failed_at is not None and time.time() - failed_at < PROCESSOR_RETRY_SECONDS:
+            return None
+        for local_files_only in (True, False):
+            try:
+                _processor_state["processor"] = AutoProcessor.from_pretrained(
+                    IDEFICS_CHECKPOINT, local_files_only=local_files_only
+                )
+                _processor_state["failed_at"] = None
+                return _processor_state["processor"]
+            except Exception as e:
+                if not local_files_only:
+                    print(f"Could not load the {IDEFICS_CHECKPOINT} processor, using the fallback chat template: {e}")
+        _processor_state["failed_at"] = time.time()
+        return None
+
+
+def build_idefics_prompt(query: str) -> str:
+    processor = get_idefics_processor()
+    if processor is None:
+        return IDEFICS_FALLBACK_TEMPLATE.format(query=query)
     messages = [
         {
             "role": "user",
@@ -30,27 +76,14 @@ def process_images_and_text(image_path, query, client):
             ],
         },
     ]
+    return processor.apply_chat_template(messages, add_generation_prompt=True)
 
-    prompt_with_template = idefics_processor.apply_chat_template(messages, add_generation_prompt=True)
-
-    # load images from local directory
 
-    # encode images to strings which can be sent to the endpoint
-    def encode_local_image(image_path):
-        # load image
-        image = Image.open(image_path).convert("RGB")
+def process_images_and_text(image_path, query, client, max_pixels=DEFAULT_MAX_PIXELS, max_bytes=DEFAULT_MAX_BYTES):
+    prompt_with_template = build_idefics_prompt(query)
 
-        # Convert the image to a base64 string
-        buffer = BytesIO()
-        image.save(buffer, format="JPEG")  # Use the appropriate format (e.g., JPEG, PNG)
-        base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-        # add string formatting required by the endpoint
-        image_string = f"data:image/jpeg;base64,{base64_image}"
-
-        return image_string
-
-    image_string = encode_local_image(image_path)
+    # encode the image to a string which can be sent to the endpoint, downsized to the upload budget
+    image_string = prepare_image(image_path, max_pixels=max_pixels, max_bytes=max_bytes).data_uri
     prompt_with_images = prompt_with_template.replace("<image>", "![]({}) ").format(image_string)
 
     payload = {
@@ -64,47 +97,53 @@ def process_images_and_text(image_path, query, client):
     return json.loads(client.post(json=payload).decode())[0]
 
 
-# Function to encode the image
-def encode_image(image_path):
-    if image_path.startswith("http"):
-        user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0"
-        request_kwargs = {
-            "headers": {"User-Agent": user_agent},
-            "stream": True,
-        }
+_downloaded_images: Dict[str, str] = {}
+_downloaded_images_lock = threading.Lock()
+
 
-        # Send a HTTP request to the URL
-        response = requests.get(image_path, **request_kwargs)
-        response.raise_for_status()
-        content_type = response.headers.get("content-type", "")
+def download_image(url: str) -> str:
+    """Download an image once per process and return its local path, so that it is cached and batched by content."""
+    with _downloaded_images_lock:
+        download_path = _downloaded_images.get(url)
+    if download_path is not None and os.path.isfile(download_path):
+        return download_path
 
-        extension = mimetypes.guess_extension(content_type)
-        if extension is None:
-            extension = ".download"
+    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0"
+    request_kwargs = {
+        "headers": {"User-Agent": user_agent},
+        "stream": True,
+    }
 
-        fname = str(uuid.uuid4()) + extension
-        download_path = os.path.abspath(os.path.join("downloads", fname))
+    # Send a HTTP request to the URL
+    response = requests.get(url, **request_kwargs)
+    response.raise_for_status()
+    content_type = response.headers.get("content-type", "")
 
-        with open(download_path, "wb") as fh:
-            for chunk in response.iter_content(chunk_size=512):
-                fh.write(chunk)
+    extension = mimetypes.guess_extension(content_type)
+    if extension is None:
+        extension = ".download"
 
-        image_path = download_path
+    fname = str(uuid.uuid4()) + extension
+    download_path = os.path.abspath(os.path.join("downloads", fname))
 
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+    with open(download_path, "wb") as fh:
+        for chunk in response.iter_content(chunk_size=512):
+            fh.write(chunk)
 
+    with _downloaded_images_lock:
+        _downloaded_images[url] = download_path
+    return download_path
 
-headers = {"Content-Type": "application/json", "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
 
+# Function to encode the image
+def encode_image(image_path, max_pixels=DEFAULT_MAX_PIXELS, max_bytes=DEFAULT_MAX_BYTES) -> EncodedImage:
+    if image_path.startswith("http"):
+        image_path = download_image(image_path)
+
+    return prepare_image(image_path, max_pixels=max_pixels, max_bytes=max_bytes)
 
-def resize_image(image_path):
-    img = Image.open(image_path)
-    width, height = img.size
-    img = img.resize((int(width / 2), int(height / 2)))
-    new_image_path = f"resized_{image_path}"
-    img.save(new_image_path)
-    return new_image_path
+
+headers = {"Content-Type": "application/json", "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
 
 
 class VisualQATool(Tool):
@@ -119,7 +158,15 @@ class VisualQATool(Tool):
     }
     output_type = "string"
 
-    client = InferenceClient("HuggingFaceM4/idefics2-8b-chatty")
+    _client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from huggingface_hub import InferenceClient
+
+            self._client = InferenceClient(IDEFICS_CHECKPOINT)
+        return self._client
 
     def forward(self, image_path: str, question: Optional[str] = None) -> str:
         output = ""
@@ -132,8 +179,14 @@ class VisualQATool(Tool):
         except Exception as e:
             print(e)
             if "Payload Too Large" in str(e):
-                new_image_path = resize_image(image_path)
-                output = process_images_and_text(new_image_path, question, self.client)
+                # Retry at half the width and height, without writing a resized copy next to the source
+                output = process_images_and_text(
+                    image_path,
+                    question,
+                    self.client,
+                    max_pixels=DEFAULT_MAX_PIXELS // 4,
+                    max_bytes=DEFAULT_MAX_BYTES // 4,
+                )
 
         if add_note:
             output = (
@@ -143,44 +196,172 @@ class VisualQATool(Tool):
         return output
 
 
-@tool
-def visualizer(image_path: str, question: Optional[str] = None) -> str:
-    """A tool that can answer questions about attached images.
+VISUALIZER_MODEL = "gpt-4o"
+VISUALIZER_API_BASE = os.getenv("VISUALIZER_API_BASE", "https://api.openai.com/v1")
+# While a request about an image is in flight, how long the next question about it waits for others to batch with
+VISUALIZER_BATCH_WINDOW = float(os.getenv("VISUALIZER_BATCH_WINDOW", 0.05))
+VISUALIZER_ANSWER_TTL = 7 * 24 * 3600
 
-    Args:
-        image_path: The path to the image on which to answer the question. This should be a local path to downloaded image.
-        question: The question to answer.
-    """
+BATCH_ANSWER_PATTERN = re.compile(r"^#+\s*Answer\s+(\d+)\s*:?\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def _visualizer_cache_key(image_hash: str, question: str) -> str:
+    return make_key(image_hash, normalize_question(question), VISUALIZER_MODEL)
 
-    add_note = False
-    if not question:
-        add_note = True
-        question = "Please write a detailed caption for this image."
-    if not isinstance(image_path, str):
-        raise Exception("You should provide at least `image_path` string argument to this tool!")
 
-    mime_type, _ = mimetypes.guess_type(image_path)
-    base64_image = encode_image(image_path)
+def _query_vision_model(image_path: str, prompt: str, max_tokens: int = 1000) -> str:
+    image = encode_image(image_path)
 
     payload = {
-        "model": "gpt-4o",
+        "model": VISUALIZER_MODEL,
         "messages": [
             {
                 "role": "user",
                 "content": [
-                    {"type": "text", "text": question},
-                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}},
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": {"url": image.data_uri}},
                 ],
             }
         ],
-        "max_tokens": 1000,
+        "max_tokens": max_tokens,
     }
-    response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+    response = requests.post(f"{VISUALIZER_API_BASE}/chat/completions", headers=headers, json=payload)
     try:
-        output = response.json()["choices"][0]["message"]["content"]
+        return response.json()["choices"][0]["message"]["content"]
     except Exception:
         raise Exception(f"Response format unexpected: {response.json()}")
 
+
+def _split_batch_answers(response: str, num_questions: int) -> List[Optional[str]]:
+    answers: List[Optional[str]] = [None] * num_questions
+    matches = list(BATCH_ANSWER_PATTERN.finditer(response))
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        index = int(match.group(1)) - 1
+        end = next_match.start() if next_match is not None else len(response)
+        answer = response[match.end() : end].strip()
+        if 0 <= index < num_questions and answer:
+            answers[index] = answer
+    return answers
+
+
+def visualizer_batch(image_path: str, questions: List[str], count_lookups: bool = True) -> List[str]:
+    """Answer several questions about one image, uploading the image once for all uncached questions.
+
+    Answers are cached per question, and any answer missing from the batched response is asked again on its own.
+    Without `count_lookups`, cache lookups are left out of the cache stats, as the caller already counted them.
+    """
+    if image_path.startswith("http"):
+        image_path = download_image(image_path)
+    cache = get_cache("visualizer_answers", ttl=VISUALIZER_ANSWER_TTL)
+    image_hash = hash_file(image_path)
+    keys = [_visualizer_cache_key(image_hash, question) for question in questions]
+    answers = {}
+    pending = {}
+    for key, question in zip(keys, questions):
+        if key in answers or key in pending:
+            continue
+        cached = cache.get(key) if count_lookups else cache.peek(key)
+        if cached is not None:
+            answers[key] = cached
+        else:
+            pending[key] = question
+
+    if len(pending) == 1:
+        [(key, question)] = pending.items()
+        answers[key] = _query_vision_model(image_path, question)
+        cache.set(key, answers[key])
+    elif len(pending) > 1:
+        prompt = (
+            "Answer each of the following questions about this image independently and completely.\n"
+            "Format your response exactly like this, with one heading per question:\n"
+            "### Answer 1\n<answer to question 1>\n### Answer 2\n<answer to question 2>\n\nQuestions:\n"
+            + "\n".join(f"{i + 1}. {question}" for i, question in enumerate(pending.values()))
+        )
+        response = _query_vision_model(image_path, prompt, max_tokens=min(1000 * len(pending), 4096))
+        for (key, question), answer in zip(pending.items(), _split_batch_answers(response, len(pending))):
+            if answer is None:
+                answer = _query_vision_model(image_path, question)
+            answers[key] = answer
+            cache.set(key, answer)
+
+    return [answers[key] for key in keys]
+
+
+_pending_questions: Dict[str, List[Tuple[str, Future]]] = {}
+# Number of vision requests being sent per image
+_requests_in_flight: Dict[str, int] = {}
+_pending_questions_lock = threading.Lock()
+
+
+def _send_batch(image_path: str, image_key: str, batch: List[Tuple[str, Future]]) -> None:
+    try:
+        # Each question was counted once by `ask_visualizer`
+        answers = visualizer_batch(image_path, [question for question, _ in batch], count_lookups=False)
+        for (_, future), answer in zip(batch, answers):
+            future.set_result(answer)
+    except Exception as e:
+        for _, future in batch:
+            future.set_exception(e)
+    finally:
+        with _pending_questions_lock:
+            _requests_in_flight[image_key] -= 1
+            if not _requests_in_flight[image_key]:
+                del _requests_in_flight[image_key]
+
+
+def ask_visualizer(image_path: str, question: str) -> str:
+    """Answer one question, batching it with questions that other threads ask about the same image meanwhile.
+
+    A question about an image with no request in flight is sent at once. Otherwise the first waiting question waits
+    `VISUALIZER_BATCH_WINDOW` for others to join it, and they are sent together.
+    """
+    if image_path.startswith("http"):
+        image_path = download_image(image_path)
+    image_key = hash_file(image_path)
+    cached = get_cache("visualizer_answers", ttl=VISUALIZER_ANSWER_TTL).get(_visualizer_cache_key(image_key, question))
+    if cached is not None:
+        return cached
+
+    future = Future()
+    batch = None
+    is_leader = False
+    with _pending_questions_lock:
+        if image_key in _pending_questions:
+            _pending_questions[image_key].append((question, future))
+        elif not _requests_in_flight.get(image_key):
+            batch = [(question, future)]
+            _requests_in_flight[image_key] = 1
+        else:
+            _pending_questions[image_key] = [(question, future)]
+            is_leader = True
+    if is_leader:
+        time.sleep(VISUALIZER_BATCH_WINDOW)
+        with _pending_questions_lock:
+            batch = _pending_questions.pop(image_key)
+            _requests_in_flight[image_key] = _requests_in_flight.get(image_key, 0) + 1
+    if batch is not None:
+        _send_batch(image_path, image_key, batch)
+    return future.result()
+
+
+@tool
+def visualizer(image_path: str, question: Optional[str] = None) -> str:
+    """A tool that can answer questions about attached images.
+
+    Args:
+        image_path: The path to the image on which to answer the question. This should be a local path to downloaded image.
+        question: The question to answer.
+    """
+
+    add_note = False
+    if not question:
+        add_note = True
+        question = "Please write a detailed caption for this image."
+    if not isinstance(image_path, str):
+        raise Exception("You should provide at least `image_path` string argument to this tool!")
+
+    output = ask_visualizer(image_path, question)
+
     if add_note:
         output = f"You did not provide a particular question, so here is a detailed caption for the image: {output}"
 
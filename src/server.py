@@ -0,0 +1,259 @@
+"""Answer questions from a long-lived process, keeping agents, browsers, model clients and caches warm.
+
+    python src/server.py --port 8000 --concurrency 4
+
+    curl -N localhost:8000/questions -d '{"question": "..."}'   # streams NDJSON progress events, then the answer
+    curl localhost:8000/health                                   # queue, workers and cache statistics
+
+Questions wait in a bounded queue: when it is full, new questions are refused with a 503 and a Retry-After header.
+Point `--api-base` (or LLM_API_BASE) at a local OpenAI-compatible stub to run it without network.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from assistant import API_BASE, create_model, run_question
+from scripts.cache import cache_stats
+from scripts.hierarchy import create_agent_hierarchy
+from scripts.ledger import CostLedger
+from scripts.message_store import MessageStore
+from scripts.model_roles import ROLE_MODEL_HELP, create_role_models, role_model_specs
+from scripts.model_wrappers import LLM_CACHE_MODES
+
+
+OBSERVATION_PREVIEW_CHARS = 500
+RETRY_AFTER_SECONDS = 5
+STATUS_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 503: "Service Unavailable"}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of questions answered at the same time.")
+    parser.add_argument("--queue-size", type=int, default=32, help="Questions waiting beyond this are refused.")
+    parser.add_argument("--api-base", type=str, default=API_BASE, help="OpenAI-compatible endpoint of the model.")
+    parser.add_argument("--llm-cache", choices=LLM_CACHE_MODES, default="passthrough")
+    parser.add_argument("--role-model", type=str, action="append", default=[], help=ROLE_MODEL_HELP)
+    return parser.parse_args()
+
+
+class Job:
+    """A queued question and the stream of events sent back to its client."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, question: str, loop: asyncio.AbstractEventLoop):
+        self.id = next(self.ids)
+        self.question = question
+        self.loop = loop
+        self.events: asyncio.Queue = asyncio.Queue()
+
+    def emit(self, event: Dict) -> None:
+        """Thread-safe: agents report progress from the executor threads."""
+        event = {"job_id": self.id, "time": time.time(), **event}
+        self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+
+class WarmHierarchy:
+    """An agent hierarchy built once and reused for every question of one worker."""
+
+    def __init__(self, model, role_models: Dict = None):
+        self.model = model
+        self.role_models = role_models or {}
+        self.ledger = CostLedger()
+        self.message_store = MessageStore(compress=True)
+        self.agent = create_agent_hierarchy(model, self.ledger, self.message_store, self.role_models)
+        self.job: Optional[Job] = None
+
+        self.ledger.add_listener(self._on_call)
+        agents = {"manager": self.agent, **getattr(self.agent, "managed_agents", {})}
+        for name, agent in agents.items():
+            agent.step_callbacks.append(self._step_callback(name))
+
+    def _on_call(self, record: Dict) -> None:
+        if self.job is not None:
+            self.job.emit({"event": "call", **{key: value for key, value in record.items() if key != "timestamp"}})
+
+    def _step_callback(self, agent_name: str):
+        def on_step(memory_step) -> None:
+            if self.job is None:
+                return
+            self.job.emit(
+                {
+                    "event": "step",
+                    "agent": agent_name,
+                    "step": getattr(memory_step, "step_number", None),
+                    "tool_calls": [tool_call.name for tool_call in getattr(memory_step, "tool_calls", None) or []],
+                    "duration": getattr(memory_step, "duration", None),
+                    "error": str(memory_step.error) if getattr(memory_step, "error", None) else None,
+                    "observations": (getattr(memory_step, "observations", None) or "")[:OBSERVATION_PREVIEW_CHARS],
+                }
+            )
+
+        return on_step
+
+    def answer(self, job: Job) -> Dict:
+        self.job = job
+        self.ledger.reset(question_id=str(job.id))
+        self.message_store.clear()
+        try:
+            annotated_example = run_question(
+                self.agent,
+                self.model,
+                self.ledger,
+                self.message_store,
+                job.question,
+                self.role_models.get("reformulator"),
+            )
+        finally:
+            self.job = None
+        annotated_example.pop("intermediate_steps", None)
+        return annotated_example
+
+
+class ResearchServer:
+    def __init__(
+        self, concurrency: int, queue_size: int, api_base: str, llm_cache_mode: str, role_model_cli_specs=None
+    ):
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        model = create_model(llm_cache_mode, api_base)
+        role_models = create_role_models(
+            model,
+            lambda model_id: create_model(llm_cache_mode, api_base, model_id=model_id),
+            role_model_specs(role_model_cli_specs),
+        )
+        self.hierarchies = [WarmHierarchy(model, role_models) for _ in range(concurrency)]
+        self.active = 0
+        self.answered = 0
+        self.failed = 0
+
+    async def worker(self, hierarchy: WarmHierarchy) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            self.active += 1
+            job.emit({"event": "started"})
+            try:
+                annotated_example = await loop.run_in_executor(self.executor, hierarchy.answer, job)
+                self.answered += 1
+                job.emit({"event": "answer", **annotated_example})
+            except Exception as e:
+                self.failed += 1
+                job.emit({"event": "error", "error": str(e)})
+            finally:
+                self.active -= 1
+                self.queue.task_done()
+
+    def health(self) -> Dict:
+        return {
+            "queued": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "active": self.active,
+            "workers": self.concurrency,
+            "answered": self.answered,
+            "failed": self.failed,
+            "caches": cache_stats(),
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, path, headers, body = await read_request(reader)
+            if path == "/health":
+                await send_json(writer, 200, self.health())
+            elif path != "/questions":
+                await send_json(writer, 404, {"error": f"Unknown path {path}"})
+            elif method != "POST":
+                await send_json(writer, 405, {"error": "Questions must be POSTed"})
+            else:
+                await self.handle_question(writer, body)
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            await send_json(writer, 400, {"error": f"Malformed request: {e}"})
+        except ConnectionError:
+            # The client went away: a running question still completes, its events are dropped
+            pass
+        finally:
+            writer.close()
+
+    async def handle_question(self, writer: asyncio.StreamWriter, body: bytes) -> None:
+        payload = json.loads(body or b"{}")
+        question = payload.get("question") if isinstance(payload, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            await send_json(writer, 400, {"error": 'Expected a JSON body like {"question": "..."}'})
+            return
+        job = Job(question, asyncio.get_running_loop())
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            await send_json(
+                writer, 503, {"error": "Too many questions queued, retry later"}, {"Retry-After": str(RETRY_AFTER_SECONDS)}
+            )
+            return
+        job.emit({"event": "queued", "position": self.queue.qsize()})
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        while True:
+            event = await job.events.get()
+            chunk = (json.dumps(event, default=str) + "\n").encode("utf-8")
+            writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            await writer.drain()
+            if event["event"] in ("answer", "error"):
+                break
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def serve(self, host: str, port: int) -> None:
+        workers = [asyncio.create_task(self.worker(hierarchy)) for hierarchy in self.hierarchies]
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port} with {self.concurrency} warm agents, queue size {self.queue.maxsize}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def read_request(reader: asyncio.StreamReader):
+    request_line = await reader.readline()
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, value = line.split(":", 1)
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method.upper(), path.split("?", 1)[0], headers, body
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, payload: Dict, headers: Dict = None) -> None:
+    body = json.dumps(payload, default=str).encode("utf-8")
+    head = f"HTTP/1.1 {status} {STATUS_REASONS[status]}\r\nContent-Type: application/json\r\n"
+    head += f"Content-Length: {len(body)}\r\nConnection: close\r\n"
+    head += "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+    await writer.drain()
+
+
+def main():
+    args = parse_args()
+    print(f"Starting server with arguments: {args}")
+    server = ResearchServer(args.concurrency, args.queue_size, args.api_base, args.llm_cache, args.role_model)
+    asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
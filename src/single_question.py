@@ -1,31 +1,32 @@
 import argparse
+import json
 import os
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import List
 
-import datasets
-import pandas as pd
 from dotenv import load_dotenv
-from huggingface_hub import login
 from scripts.reformulator import prepare_response
 from scripts.run_agents import (
-    get_single_file_description,
-    get_zip_description,
+    describe_attachments,
+    get_cached_attachments_prompt,
+    get_tasks_to_run,
 )
+from scripts.cache import cache_stats
+from scripts.gaia_dataset import load_eval_set
+from scripts.hierarchy import create_agent_hierarchy
+from scripts.checkpoint import Checkpointer, find_browser
+from scripts.ledger import CostLedger, instrument_model, instrument_tools
+from scripts.message_store import MessageStore
+from scripts.model_roles import ROLE_MODEL_HELP, create_role_models, role_model_specs
+from scripts.model_wrappers import LLM_CACHE_MODES, wrap_model_for_cache
+from scripts.results_store import ResultsStore
+from scripts.scheduler import RuntimeHistory, Schedule
+from scripts.task_queue import TaskQueue, default_worker_id
 from scripts.text_inspector_tool import TextInspectorTool
-from scripts.text_web_browser import (
-    ArchiveSearchTool,
-    FinderTool,
-    FindNextTool,
-    PageDownTool,
-    PageUpTool,
-    SearchInformationTool,
-    SimpleTextBrowser,
-    VisitTool,
-)
 from scripts.visual_qa import visualizer
 from tqdm import tqdm
 
@@ -35,7 +36,6 @@ from smolagents import (
     # HfApiModel,
     OpenAIServerModel,
     Model,
-    ToolCallingAgent,
 )
 
 
@@ -66,106 +66,59 @@ AUTHORIZED_IMPORTS = [
     "csv",
 ]
 load_dotenv(override=True)
-login(os.getenv("HF_TOKEN"))
 
 append_answer_lock = threading.Lock()
+steps_file_lock = threading.Lock()
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--model-id", type=str, default="o1")
     parser.add_argument("--api-base", type=str, default=None)
-    parser.add_argument("--question", type=str, required=True)
-    return parser.parse_args()
+    parser.add_argument("--question", type=str, default=None, help="Answer a single question instead of a batch.")
+    parser.add_argument("--run-name", type=str, default=None, help="Name of the batch run, used for the answers file.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--task-ids", type=str, nargs="*", default=None, help="Only run these GAIA task ids.")
+    parser.add_argument(
+        "--llm-cache",
+        choices=LLM_CACHE_MODES,
+        default="passthrough",
+        help="Record model responses to the local cache, or replay them without network.",
+    )
+    parser.add_argument("--ledger-file", type=str, default=None, help="Append per-call costs to this JSONL file.")
+    parser.add_argument("--role-model", type=str, action="append", default=[], help=ROLE_MODEL_HELP)
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default="0/1",
+        help="I/N: this process takes the tasks of shard I of N first, then helps with the other shards. "
+        "Start one process per shard, on machines sharing the output directory on a filesystem with working file "
+        "locks (e.g. NFSv4).",
+    )
+    args = parser.parse_args()
+    if args.question is None and args.run_name is None:
+        parser.error("either --question or --run-name is required")
+    shard, _, num_shards = args.shard.partition("/")
+    args.shard, args.num_shards = int(shard), int(num_shards or 1)
+    if not 0 <= args.shard < args.num_shards:
+        parser.error("--shard must be I/N with 0 <= I < N")
+    return args
 
 
 ### IMPORTANT: EVALUATION SWITCHES
 
-print("Make sure you deactivated Tailscale VPN, else some URLs will be blocked!")
-
 USE_OPEN_MODELS = False
 
 SET = "validation"
 
 custom_role_conversions = {"tool-call": "assistant", "tool-response": "user"}
 
-### LOAD EVALUATION DATASET
-
-eval_ds = datasets.load_dataset("gaia-benchmark/GAIA", "2023_all")[SET]
-eval_ds = eval_ds.rename_columns({"Question": "question", "Final answer": "true_answer", "Level": "task"})
-
-
-def preprocess_file_paths(row):
-    if len(row["file_name"]) > 0:
-        row["file_name"] = f"data/gaia/{SET}/" + row["file_name"]
-    return row
-
-
-eval_ds = eval_ds.map(preprocess_file_paths)
-eval_df = pd.DataFrame(eval_ds)
-print("Loaded evaluation dataset:")
-print(eval_df["task"].value_counts())
-
-user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36 Edg/119.0.0.0"
-
-BROWSER_CONFIG = {
-    "viewport_size": 1024 * 5,
-    "downloads_folder": "downloads_folder",
-    "request_kwargs": {
-        "headers": {"User-Agent": user_agent},
-        "timeout": 300,
-    },
-    "serpapi_key": os.getenv("SERPAPI_API_KEY"),
-}
-
-os.makedirs(f"./{BROWSER_CONFIG['downloads_folder']}", exist_ok=True)
-
-
-def create_agent_hierarchy(model: Model):
-    text_limit = 100000
-    ti_tool = TextInspectorTool(model, text_limit)
-
-    browser = SimpleTextBrowser(**BROWSER_CONFIG)
-
-    WEB_TOOLS = [
-        SearchInformationTool(browser),
-        VisitTool(browser),
-        PageUpTool(browser),
-        PageDownTool(browser),
-        FinderTool(browser),
-        FindNextTool(browser),
-        ArchiveSearchTool(browser),
-        TextInspectorTool(model, text_limit),
-    ]
-    text_webbrowser_agent = ToolCallingAgent(
-        model=model,
-        tools=WEB_TOOLS,
-        max_steps=20,
-        verbosity_level=2,
-        planning_interval=4,
-        name="search_agent",
-        description="""A team member that will search the internet to answer your question.
-    Ask him for all your questions that require browsing the web.
-    Provide him as much context as possible, in particular if you need to search on a specific timeframe!
-    And don't hesitate to provide him with a complex search task, like finding a difference between two webpages.
-    Your request must be a real sentence, not a google search! Like "Find me this information (...)" rather than a few keywords.
-    """,
-        provide_run_summary=True,
-        managed_agent_prompt=MANAGED_AGENT_PROMPT
-        + """You can navigate to .txt online files.
+SEARCH_AGENT_PROMPT = (
+    MANAGED_AGENT_PROMPT
+    + """You can navigate to .txt online files.
     If a non-html page is in another format, especially .pdf or a Youtube video, use tool 'inspect_file_as_text' to inspect it.
-    Additionally, if after some searching you find out that you need more information to answer the question, you can use `final_answer` with your request for clarification as argument to request for more information.""",
-    )
-
-    manager_agent = ToolCallingAgent(
-        model=model,
-        tools=[visualizer, ti_tool],
-        max_steps=12,
-        verbosity_level=2,
-        planning_interval=4,
-        managed_agents=[text_webbrowser_agent],
-    )
-    return manager_agent
+    Additionally, if after some searching you find out that you need more information to answer the question, you can use `final_answer` with your request for clarification as argument to request for more information."""
+)
 
 
 def append_answer(entry: dict, jsonl_file: str) -> None:
@@ -177,27 +130,83 @@ def append_answer(entry: dict, jsonl_file: str) -> None:
     print("Answer exported to file:", jsonl_file.resolve())
 
 
-def answer_single_question(question: str, model_id: str):
+def create_model(llm_cache_mode: str = "passthrough", model_id: str = "gpt-3.5-turbo-1106") -> Model:
     model = OpenAIServerModel(
-        model_id="gpt-3.5-turbo-1106",
+        model_id=model_id,
         api_base="https://openrouter.ai/api/v1", # Leave this blank to query OpenAI servers.
-        api_key=os.environ["SMOL_KEY"], # Switch to the API key for the server you're targeting.
+        api_key=os.environ.get("SMOL_KEY"), # Switch to the API key for the server you're targeting.
+    )
+    return wrap_model_for_cache(model, llm_cache_mode)
+
+
+def create_models(llm_cache_mode: str = "passthrough", role_model_cli_specs: List[str] = None):
+    """The default model, and the model of every role of the hierarchy."""
+    model = create_model(llm_cache_mode)
+    role_models = create_role_models(
+        model, lambda model_id: create_model(llm_cache_mode, model_id), role_model_specs(role_model_cli_specs)
+    )
+    return model, role_models
+
+
+def prepare_attachments(
+    examples: List[dict], llm_cache_mode: str, ledger_file: str = None, role_model_cli_specs: List[str] = None
+) -> None:
+    """Describe the attachments of a batch up front, with their own tools and ledger."""
+    _, role_models = create_models(llm_cache_mode, role_model_cli_specs)
+    ledger = CostLedger(question_id="attachments")
+    document_inspection_tool = TextInspectorTool(
+        instrument_model(role_models["text_inspector"], ledger, "text_inspector"), 100000
     )
+    [visual_inspection_tool] = instrument_tools([visualizer], ledger)
+    describe_attachments(examples, visual_inspection_tool, document_inspection_tool)
+    if ledger_file is not None:
+        ledger.write_jsonl(ledger_file)
+
+
+def answer_single_question(
+    example: dict,
+    model_id: str,
+    answers_file: str = None,
+    visual_inspection_tool=visualizer,
+    llm_cache_mode: str = "passthrough",
+    ledger_file: str = None,
+    steps_file: str = None,
+    checkpoint_file: str = None,
+    results_store: ResultsStore = None,
+    run_id: str = None,
+    role_model_cli_specs: List[str] = None,
+):
+    model, role_models = create_models(llm_cache_mode, role_model_cli_specs)
     # model = HfApiModel("Qwen/Qwen2.5-72B-Instruct", provider="together")
     #     "https://lnxyuvj02bpe6mam.us-east-1.aws.endpoints.huggingface.cloud",
     #     custom_role_conversions=custom_role_conversions,
     #     # provider="sambanova",
     #     max_tokens=8096,
     # )
-    document_inspection_tool = TextInspectorTool(model, 100000)
-
-    agent = create_agent_hierarchy(model)
+    ledger = CostLedger(question_id=example.get("task_id"))
+    document_inspection_tool = TextInspectorTool(
+        instrument_model(role_models["text_inspector"], ledger, "text_inspector"), 100000
+    )
+    [visual_inspection_tool] = instrument_tools([visual_inspection_tool], ledger)
+
+    message_store = MessageStore(compress=True)
+    agent = create_agent_hierarchy(model, ledger, message_store, role_models, search_agent_prompt=SEARCH_AGENT_PROMPT)
+    checkpointer = None
+    if checkpoint_file is not None:
+        checkpointer = Checkpointer(checkpoint_file, agent, find_browser(agent))
+        restored = checkpointer.restore()
+        if restored:
+            print(f"Resuming task {example.get('task_id')} from its checkpoint, {restored} steps already done")
+        checkpointer.attach()
 
     augmented_question = """You have one question to answer. It is paramount that you provide a correct answer.
 Give it all you can: I know for a fact that you have access to all the relevant tools to solve it and find the correct answer (the answer does exist). Failure or 'I cannot answer' or 'None found' will not be tolerated, success will be rewarded.
 Run verification steps if that's needed, you must make sure you find the correct answer!
 Here is the task:
-""" + question
+""" + example["question"]
+
+    # Usually described ahead by the batch pre-pass
+    augmented_question += get_cached_attachments_prompt(example, visual_inspection_tool, document_inspection_tool)
 
     start_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
@@ -206,11 +215,15 @@ Here is the task:
 
         agent_memory = agent.write_memory_to_messages(summary_mode=True)
 
-        final_result = prepare_response(augmented_question, agent_memory, reformulation_model=model)
+        final_result = prepare_response(
+            augmented_question,
+            agent_memory,
+            reformulation_model=instrument_model(role_models["reformulator"], ledger, "reformulator"),
+            agent_answer=str(final_result),
+        )
 
         output = str(final_result)
-        for memory_step in agent.memory.steps:
-            memory_step.model_input_messages = None
+        message_store.intern_steps(agent.memory.steps)
         intermediate_steps = [str(step) for step in agent.memory.steps]
 
         # Check for parsing errors which indicate the LLM failed to follow the required format
@@ -231,7 +244,7 @@ Here is the task:
     end_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     annotated_example = {
         "agent_name": model.model_id,
-        "question": question,
+        "question": example["question"],
         "augmented_question": augmented_question,
         "prediction": output,
         "intermediate_steps": intermediate_steps,
@@ -240,16 +253,152 @@ Here is the task:
         "agent_error": str(exception) if raised_exception else None,
         "start_time": start_time,
         "end_time": end_time,
+        "task": example.get("task"),
+        "task_id": example.get("task_id"),
+        "true_answer": example.get("true_answer"),
+        "ledger": ledger.summary(),
+        "budget": agent.budget.report(),
     }
     print(f"Answer: {output}")
+    print(f"Cache stats: {cache_stats()}")
+    print(ledger.summary_table())
+    if ledger_file is not None:
+        ledger.write_jsonl(ledger_file)
+    if steps_file is not None:
+        # Each message is written once, steps reference it by key
+        with steps_file_lock, open(steps_file, "a", encoding="utf-8") as fp:
+            message_store.write_jsonl(fp, agent.memory.steps, question_id=example.get("task_id"))
+    if raised_exception and results_store is not None:
+        # Not an answer: the batch worker fails the lease, and the next attempt resumes from the checkpoint
+        raise exception
+    if results_store is not None:
+        results_store.add(run_id, annotated_example)
+    elif answers_file is not None:
+        append_answer(annotated_example, answers_file)
+    if checkpointer is not None and not raised_exception:
+        checkpointer.remove()
+    return annotated_example
+
+
+def run_batch(
+    run_name: str,
+    model_id: str,
+    concurrency: int,
+    task_ids: List[str] = None,
+    llm_cache_mode: str = "passthrough",
+    shard: int = 0,
+    num_shards: int = 1,
+    role_model_cli_specs: List[str] = None,
+) -> None:
+    """Answer the evaluation set concurrently, resuming from the answers already written for `run_name`.
+
+    Tasks are pulled from a queue shared by every process running `run_name`, so several processes, on one machine or
+    on several sharing the output directory on a filesystem with working file locks, split the run between them
+    without answering a task twice.
+    """
+    print("Make sure you deactivated Tailscale VPN, else some URLs will be blocked!")
+    eval_ds = load_eval_set(SET)
+    examples = {str(example["task_id"]): example for example in eval_ds}
+    base_filename = Path(f"output/{SET}/{run_name}")
+    answers_file = base_filename.parent / f"{base_filename.stem}_answers.jsonl"
+    ledger_file = base_filename.parent / f"{base_filename.stem}_ledger.jsonl"
+    steps_file = base_filename.parent / f"{base_filename.stem}_steps.jsonl"
+    checkpoint_dir = base_filename.parent / f"{base_filename.stem}_checkpoints"
+    results_store = ResultsStore(base_filename.parent / "results.sqlite")
+    tasks_to_run = get_tasks_to_run(eval_ds, len(eval_ds), base_filename, task_ids, results_store)
+    print(f"{len(eval_ds) - len(tasks_to_run)} tasks already answered, {len(tasks_to_run)} to run.")
+    # Longest expected tasks first, so that none starts late and stretches the end of the run
+    schedule = Schedule(tasks_to_run, RuntimeHistory.load(base_filename.parent, results_store), concurrency)
+    print(schedule.describe())
+    tasks_to_run.sort(key=lambda example: schedule.estimates[str(example["task_id"])], reverse=True)
+    task_queue = TaskQueue(base_filename.parent / "results.sqlite", base_filename.name)
+    task_queue.enqueue(schedule.estimates, priorities=schedule.priorities())
+
+    start = time.time()
+    progress = tqdm(total=len(tasks_to_run), desc="Answering questions", unit="question")
+    progress_lock = threading.Lock()
+    answered = failed = 0
+    task_seconds = {}
+
+    def work() -> None:
+        nonlocal answered, failed
+        worker_id = default_worker_id()
+        while (task_id := task_queue.next_task(worker_id, shard, num_shards)) is not None:
+            example = examples[task_id]
+            # One crashing question must not take down the batch: it goes back to the queue for another attempt
+            task_start = time.time()
+            try:
+                with task_queue.keep_alive(task_id, worker_id):
+                    answer_single_question(
+                        example,
+                        model_id,
+                        llm_cache_mode=llm_cache_mode,
+                        ledger_file=ledger_file,
+                        steps_file=steps_file,
+                        checkpoint_file=checkpoint_dir / f"{task_id}.pkl.gz",
+                        results_store=results_store,
+                        run_id=base_filename.name,
+                        role_model_cli_specs=role_model_cli_specs,
+                    )
+                task_queue.complete(task_id, worker_id)
+                task_seconds[task_id] = time.time() - task_start
+                succeeded = True
+            except Exception as e:
+                print(f"Task {task_id} failed: {e}")
+                task_queue.fail(task_id, worker_id, str(e))
+                succeeded = False
+            with progress_lock:
+                answered += succeeded
+                failed += not succeeded
+                progress.update(succeeded)
+                elapsed = time.time() - start
+                progress.set_postfix(failed=failed, questions_per_min=f"{60 * answered / elapsed:.2f}")
+
+    with ThreadPoolExecutor(max_workers=concurrency + 1) as exe:
+        # Runs alongside the workers: one reaching a task still being described waits for its description
+        prepass = exe.submit(prepare_attachments, tasks_to_run, llm_cache_mode, ledger_file, role_model_cli_specs)
+        for future in [exe.submit(work) for _ in range(concurrency)]:
+            future.result()
+        try:
+            prepass.result()
+        except Exception as e:
+            print(f"Attachment pre-pass failed: {e}")
+    progress.close()
+
+    results_store.export_jsonl(base_filename.name, answers_file)
+    elapsed = time.time() - start
+    print(
+        f"This process answered {answered} questions in {elapsed / 60:.1f} min "
+        f"({60 * answered / max(elapsed, 1e-9):.2f} questions/min), with {failed} failed attempts. "
+        f"Queue: {task_queue.counts()}, answers in {answers_file.resolve()}"
+    )
+    print(f"Schedule: {schedule.report(elapsed, task_seconds)}")
 
 
 def main():
     args = parse_args()
     print(f"Starting run with arguments: {args}")
 
-    answer_single_question(args.question, args.model_id)
+    if args.question is not None:
+        answer_single_question(
+            {"question": args.question, "file_name": ""},
+            args.model_id,
+            llm_cache_mode=args.llm_cache,
+            ledger_file=args.ledger_file,
+            role_model_cli_specs=args.role_model,
+        )
+    else:
+        run_batch(
+            args.run_name,
+            args.model_id,
+            args.concurrency,
+            args.task_ids,
+            args.llm_cache,
+            shard=args.shard,
+            num_shards=args.num_shards,
+            role_model_cli_specs=args.role_model,
+        )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# The modules live under src/ and are imported as `scripts.<module>`, as when running from src/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
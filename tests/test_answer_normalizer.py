@@ -0,0 +1,65 @@
+import pytest
+
+from scripts.answer_normalizer import normalize_final_answer
+from scripts.self_consistency import vote_key
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        "The answer is Paris",
+        "Based on my research, the capital is Paris",
+        "It was written by Mark Twain",
+        "Paris is the capital",
+        "They have 3 cats",
+        "It's Paris",
+        "Final answer: the answer is 42",
+    ],
+)
+def test_sentences_are_left_to_the_llm(answer):
+    assert normalize_final_answer(answer, "What is the capital of France?") is None
+
+
+@pytest.mark.parametrize(
+    "answer, question, expected",
+    [
+        ("The Netherlands", "Which country?", "The Netherlands"),
+        ("Mark Twain", "Who wrote it?", "Mark Twain"),
+        ("Paris.", "What is the capital of France?", "Paris"),
+        ("1,234", "How many people?", "1234"),
+        ("$1,500", "What did it cost?", "1500"),
+        ("12 km", "How far is it?", "12"),
+        ("seven", "How many?", "7"),
+        ("apples; bananas,  cherries", "Which fruits?", "apples, bananas, cherries"),
+        ("3, 5, 8", "Which numbers?", "3, 5, 8"),
+    ],
+)
+def test_bare_values_are_normalized(answer, question, expected):
+    assert normalize_final_answer(answer, question) == expected
+
+
+@pytest.mark.parametrize(
+    "answer, question",
+    [
+        ("12 km", "Which distance?"),
+        ("St. Petersburg", "Which city?"),
+        ("1,000, 2,000", "Which numbers?"),
+        ("Paris", "Give the city in upper case."),
+        ("probably Paris", "Which city?"),
+        ("None", "Which city?"),
+        ("N/A", "Which city?"),
+        ("unknown", "Which city?"),
+        ("Not found.", "Which city?"),
+        ("", "Which city?"),
+        ("  ", "Which city?"),
+        ("a", "Which letter?"),
+        ("The", "Which word?"),
+        ("Paris, none", "Which cities?"),
+    ],
+)
+def test_unsure_cases_are_left_to_the_llm(answer, question):
+    assert normalize_final_answer(answer, question) is None
+
+
+def test_articles_do_not_split_votes():
+    assert vote_key("The Netherlands", "Which country?") == vote_key("netherlands.", "Which country?")
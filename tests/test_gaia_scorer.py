@@ -0,0 +1,103 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+from scripts.gaia_scorer import check_close_call, question_scorer, score_answers, score_results
+
+
+# (prediction, ground truth): numbers, lists, strings and missing answers, scored together in one batch
+CASES = [
+    # Numbers with currency, percent and thousands separators
+    ("$1,500", "1500"),
+    ("1,500.0", "1500"),
+    ("12%", "12"),
+    ("12.5 %", "12.5"),
+    ("$ 3", "3"),
+    ("1 000", "1000"),
+    ("1500", "1,500"),
+    ("about 17", "17"),
+    ("17", "17.0"),
+    ("-4", "-4"),
+    ("1e3", "1000"),
+    (None, "42"),
+    ("", "42"),
+    ("nan", "nan"),
+    # Lists separated by ',' and ';'
+    ("apple, banana", "apple,banana"),
+    ("Apple;Banana", "apple; banana"),
+    ("apple, banana", "apple; banana"),
+    ("apple, banana, cherry", "apple, banana"),
+    ("apple", "apple, banana"),
+    ("1, 2; 3", "1,2,3"),
+    ("$1, 2%", "1, 2"),
+    ("1, two", "1, 2"),
+    ("st. louis, paris", "St. Louis, Paris"),
+    ("st louis, paris", "St. Louis, Paris"),
+    ("", "a, b"),
+    (None, "a, b"),
+    (None, "x; y"),
+    # Strings with punctuation, case and whitespace differences
+    ("Sea Gull", "seagull"),
+    ("Paris.", "paris"),
+    ("PARIS", "Paris"),
+    ("Mark Twain!", "mark twain"),
+    ("Twain", "Mark Twain"),
+    ("Marc Twain", "Mark Twain"),
+    ("Right", "right-handed"),
+    ("none", "None"),
+    (None, "None"),
+    (None, "Paris"),
+    ("", "Paris"),
+    ("it's", "its"),
+    ("Saint-Petersburg", "Saint Petersburg"),
+    ("a much much longer answer than the truth", "truth"),
+]
+
+
+def _scalar_scores(prediction, truth):
+    is_correct = question_scorer(str(prediction), str(truth))
+    return is_correct, check_close_call(str(prediction), str(truth), is_correct)
+
+
+def test_score_answers_matches_the_scalar_scorer_row_by_row(capsys):
+    predictions = pd.Series([prediction for prediction, _ in CASES], dtype=object)
+    truths = pd.Series([truth for _, truth in CASES], dtype=object)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected = [_scalar_scores(prediction, truth) for prediction, truth in CASES]
+    scored = score_answers(predictions, truths)
+
+    for (prediction, truth), (is_correct, is_close_call), (_, row) in zip(CASES, expected, scored.iterrows()):
+        assert (bool(row["is_correct"]), bool(row["is_close_call"])) == (is_correct, is_close_call), (
+            f"{prediction!r} vs {truth!r}"
+        )
+    # The batch scorer neither prints nor warns
+    capsys.readouterr()
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        score_answers(predictions, truths)
+    assert capsys.readouterr().out == ""
+
+
+def test_score_answers_keeps_the_index_and_flags_list_length_mismatches():
+    predictions = pd.Series(["a, b, c", "a, b", "1"], index=[10, 20, 30], dtype=object)
+    truths = pd.Series(["a, b", "a; b", "1"], index=[10, 20, 30], dtype=object)
+
+    scored = score_answers(predictions, truths)
+
+    assert list(scored.index) == [10, 20, 30]
+    assert list(scored["answer_type"]) == ["list", "list", "number"]
+    assert list(scored["list_length_mismatch"]) == [True, False, False]
+    assert list(scored["is_correct"]) == [False, True, True]
+
+
+@pytest.mark.parametrize("missing", [None, float("nan")])
+def test_missing_predictions_are_scored_like_str_none(missing):
+    results = pd.DataFrame({"prediction": [missing, missing], "true_answer": ["None", "Paris"]})
+
+    scored = score_results(results)
+
+    assert list(scored["is_correct"]) == [question_scorer("None", "None"), question_scorer("None", "Paris")]
+    assert list(scored["outcome"]) == ["correct", "missing"]
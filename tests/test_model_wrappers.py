@@ -0,0 +1,87 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from smolagents.models import ChatMessage, ChatMessageToolCall, ChatMessageToolCallFunction
+
+from scripts.model_wrappers import CascadeModel, escalation_reason
+
+
+# What a manager offers its model: its tools, and its managed agents, which are called like tools
+MANAGER_TOOLS = [SimpleNamespace(name=name) for name in ["final_answer", "visualizer", "parallel_search"]]
+SEARCH_AGENT = SimpleNamespace(name="search_agent", description="A team member that will search the internet.")
+
+
+def tool_call_message(name: str, arguments: dict) -> ChatMessage:
+    return ChatMessage(
+        role="assistant",
+        content=None,
+        tool_calls=[
+            ChatMessageToolCall(
+                id="call_0",
+                type="function",
+                function=ChatMessageToolCallFunction(name=name, arguments=json.dumps(arguments)),
+            )
+        ],
+    )
+
+
+class ScriptedModel:
+    def __init__(self, model_id: str, message: ChatMessage):
+        self.model_id = model_id
+        self.message = message
+        self.calls = 0
+        self.last_input_token_count = 10
+        self.last_output_token_count = 5
+
+    def __call__(self, messages, **kwargs) -> ChatMessage:
+        self.calls += 1
+        return self.message
+
+
+def test_delegating_to_a_managed_agent_is_a_valid_call():
+    message = tool_call_message("search_agent", {"task": "Find the population of Lyon in 2020."})
+
+    assert escalation_reason(message, [*MANAGER_TOOLS, SEARCH_AGENT]) is None
+
+
+@pytest.mark.parametrize(
+    "name, arguments, reason",
+    [
+        ("web_search", {"query": "Lyon"}, "parse_error"),
+        ("final_answer", {"answer": "I cannot find it"}, "low_confidence"),
+        ("final_answer", {"answer": "522250"}, None),
+    ],
+)
+def test_manager_calls_are_judged_against_its_tools_and_agents(name, arguments, reason):
+    assert escalation_reason(tool_call_message(name, arguments), [*MANAGER_TOOLS, SEARCH_AGENT]) == reason
+
+
+def test_cascade_keeps_the_cheap_model_for_a_manager_delegation():
+    delegation = tool_call_message("search_agent", {"task": "Find the population of Lyon in 2020."})
+    cheap = ScriptedModel("cheap", delegation)
+    strong = ScriptedModel("strong", tool_call_message("final_answer", {"answer": "522250"}))
+    escalations = []
+    cascade = CascadeModel([cheap, strong], name="manager")
+    cascade.escalation_listeners.append(lambda *escalation: escalations.append(escalation))
+
+    message = cascade([], tools_to_call_from=[*MANAGER_TOOLS, SEARCH_AGENT])
+
+    assert message is delegation
+    assert (cheap.calls, strong.calls) == (1, 0)
+    assert escalations == []
+
+
+def test_research_agent_offers_its_managed_agents_to_the_model():
+    # Imported here: the agents pull in the browser and its dependencies
+    from scripts.agents import ResearchToolCallingAgent
+
+    manager = SimpleNamespace(
+        tools={tool.name: tool for tool in MANAGER_TOOLS}, managed_agents={SEARCH_AGENT.name: SEARCH_AGENT}
+    )
+    offered = ResearchToolCallingAgent._tools_and_managed_agents(manager)
+    message = tool_call_message("search_agent", {"task": "Find the population of Lyon in 2020."})
+
+    assert [tool.name for tool in offered] == ["final_answer", "visualizer", "parallel_search", "search_agent"]
+    assert escalation_reason(message, offered) is None
@@ -0,0 +1,166 @@
+import asyncio
+import contextlib
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+
+ANSWER = "Paris"
+
+
+class StubChatServer:
+    """A local OpenAI-compatible chat completions endpoint: tool calls are answered with `final_answer`, plain
+    completions with a short plan. While `gate` is clear, requests wait for it."""
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.gate.set()
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests += 1
+                stub.gate.wait(timeout=30)
+                message = {"role": "assistant", "content": "1. Answer the question directly."}
+                if payload.get("tools"):
+                    message = {
+                        "role": "assistant",
+                        "content": None,
+                        "tool_calls": [
+                            {
+                                "id": f"call_{stub.requests}",
+                                "type": "function",
+                                "function": {"name": "final_answer", "arguments": json.dumps({"answer": ANSWER})},
+                            }
+                        ],
+                    }
+                body = json.dumps(
+                    {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion",
+                        "created": 0,
+                        "model": payload.get("model", "stub"),
+                        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def stub():
+    server = StubChatServer()
+    yield server
+    server.gate.set()
+    server.server.shutdown()
+
+
+@pytest.fixture
+def research_server(stub, tmp_path, monkeypatch):
+    # Caches and downloads go to a scratch directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SMOL_KEY", "test")
+    import server
+
+    app = server.ResearchServer(concurrency=1, queue_size=1, api_base=stub.api_base, llm_cache_mode="passthrough")
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(app.serve("127.0.0.1", port))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{base_url}/health", timeout=1)
+            break
+        except requests.ConnectionError:
+            threading.Event().wait(0.05)
+    yield base_url
+    stub.gate.set()
+
+    async def shutdown():
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=10)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=5)
+    loop.close()
+
+
+def stream_events(response):
+    for line in response.iter_lines():
+        if line:
+            yield json.loads(line)
+
+
+def test_question_streams_progress_then_the_answer(research_server):
+    question = {"question": "What is the capital of France?"}
+    with requests.post(f"{research_server}/questions", json=question, stream=True) as response:
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == "application/x-ndjson"
+        events = list(stream_events(response))
+
+    kinds = [event["event"] for event in events]
+    assert kinds[:2] == ["queued", "started"]
+    assert kinds[-1] == "answer"
+    assert "call" in kinds and "step" in kinds
+    assert events[-1]["prediction"] == ANSWER
+    assert len({event["job_id"] for event in events}) == 1
+
+
+@pytest.mark.parametrize("body", [b"[]", b'"What is the capital of France?"', b"{}", b'{"question": "  "}', b"{not json"])
+def test_bad_question_bodies_get_a_400(research_server, body):
+    response = requests.post(f"{research_server}/questions", data=body)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_full_queue_refuses_with_retry_after(research_server, stub):
+    import server
+
+    stub.gate.clear()
+    url = f"{research_server}/questions"
+    # The only worker is busy with the first question, and the second one fills the queue
+    running = requests.post(url, json={"question": "First?"}, stream=True)
+    running_events = stream_events(running)
+    assert [next(running_events)["event"], next(running_events)["event"]] == ["queued", "started"]
+    waiting = requests.post(url, json={"question": "Second?"}, stream=True)
+    waiting_events = stream_events(waiting)
+    assert next(waiting_events)["event"] == "queued"
+
+    refused = requests.post(url, json={"question": "Third?"})
+    assert refused.status_code == 503
+    assert refused.headers["Retry-After"] == str(server.RETRY_AFTER_SECONDS)
+
+    stub.gate.set()
+    assert [event["event"] for event in running_events][-1] == "answer"
+    assert [event["event"] for event in waiting_events][-1] == "answer"
+    running.close()
+    waiting.close()
@@ -0,0 +1,105 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from scripts import cache, visual_qa
+
+
+class StubVisionServer:
+    """A local OpenAI-compatible chat completions endpoint that records prompts and can hold the first request."""
+
+    def __init__(self):
+        self.prompts = []
+        self.first_request_received = threading.Event()
+        self.release_first_request = threading.Event()
+        self.release_first_request.set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                prompt = payload["messages"][0]["content"][0]["text"]
+                stub.prompts.append(prompt)
+                if len(stub.prompts) == 1:
+                    stub.first_request_received.set()
+                    stub.release_first_request.wait(timeout=10)
+                if "\nQuestions:\n" in prompt:
+                    questions = re.findall(r"^\d+\. (.*)$", prompt.split("\nQuestions:\n")[1], re.MULTILINE)
+                    content = "\n".join(f"### Answer {i + 1}\nanswer to {q}" for i, q in enumerate(questions))
+                else:
+                    content = f"answer to {prompt}"
+                body = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = StubVisionServer()
+    monkeypatch.setattr(visual_qa, "VISUALIZER_API_BASE", server.api_base)
+    monkeypatch.setitem(cache._caches, "visualizer_answers", cache.PersistentCache(None))
+    yield server
+    server.release_first_request.set()
+    server.server.shutdown()
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / "image.png"
+    Image.new("RGB", (32, 32), "red").save(path)
+    return str(path)
+
+
+def ask_in_thread(image_path, question, answers):
+    thread = threading.Thread(target=lambda: answers.update({question: visual_qa.ask_visualizer(image_path, question)}))
+    thread.start()
+    return thread
+
+
+def test_lone_question_is_sent_without_waiting(stub, image_path, monkeypatch):
+    monkeypatch.setattr(visual_qa, "VISUALIZER_BATCH_WINDOW", 5)
+    start = time.time()
+    assert visual_qa.ask_visualizer(image_path, "What color is it?") == "answer to What color is it?"
+    assert time.time() - start < 2
+    assert len(stub.prompts) == 1
+
+
+def test_concurrent_questions_are_batched_into_one_request(stub, image_path, monkeypatch):
+    monkeypatch.setattr(visual_qa, "VISUALIZER_BATCH_WINDOW", 0.5)
+    answers = {}
+    stub.release_first_request.clear()
+    first = ask_in_thread(image_path, "What color is it?", answers)
+    assert stub.first_request_received.wait(timeout=5)
+
+    # While that request is in flight, two more questions about the same image arrive together
+    others = [ask_in_thread(image_path, question, answers) for question in ("How big is it?", "Is there any text?")]
+    for thread in others:
+        thread.join(timeout=5)
+    stub.release_first_request.set()
+    first.join(timeout=5)
+
+    assert len(stub.prompts) == 2
+    assert "How big is it?" in stub.prompts[1] and "Is there any text?" in stub.prompts[1]
+    assert answers == {question: f"answer to {question}" for question in answers}
+    assert len(answers) == 3
+
+    # Answers are cached per question, and each question counts once in the cache stats
+    assert visual_qa.ask_visualizer(image_path, "how big is  it?") == "answer to How big is it?"
+    assert len(stub.prompts) == 2
+    stats = cache._caches["visualizer_answers"].stats()
+    assert (stats["hits"], stats["misses"]) == (1, 3)